@@ -2,9 +2,13 @@ from flask import Flask, request, jsonify
 import sys
 import os
 import logging
+import gevent
 
-# Add the src directory to the system path to allow imports
-sys.path.append(os.path.join(os.path.dirname(__file__), '..'))
+# Put the repository root on the path exactly once so `src` resolves as a single
+# package and modules are never imported twice under different names.
+ROOT_DIR = os.path.abspath(os.path.join(os.path.dirname(__file__), '..'))
+if ROOT_DIR not in sys.path:
+    sys.path.insert(0, ROOT_DIR)
 
 from src.detection.main import HallucinationAnalysisPipeline
 from src.retrieval.retrieval_module import retrieve_evidence
@@ -17,6 +21,10 @@ logger = logging.getLogger(__name__)
 # Initialize the pipeline
 pipeline = HallucinationAnalysisPipeline()
 
+def retrieve_and_encode(question):
+    evidence_docs = retrieve_evidence(question)
+    return evidence_docs, pipeline.detector.encode_evidence(evidence_docs)
+
 # --- Main API route (POST only) ---
 @app.route('/detect_hallucination', methods=['POST'])
 def detect_hallucination():
@@ -28,13 +36,18 @@ def detect_hallucination():
     logger.info(f"Received question: {user_question}")
 
     try:
-        # 1. Retrieve Evidence
-        logger.info("Retrieving evidence...")
-        evidence_docs = retrieve_evidence(user_question)
-        
-        # 2. Generate & Detect
-        logger.info("Generating answer and detecting hallucinations...")
-        detection_result = pipeline.generate_and_detect(user_question, evidence_docs)
+        # 1. Retrieve and embed evidence while the raw answer is being generated. Under the
+        # gevent worker the two overlap on network I/O; without it they simply run in turn.
+        logger.info("Retrieving evidence and generating answer...")
+        retrieval = gevent.spawn(retrieve_and_encode, user_question)
+        generation = gevent.spawn(pipeline.generate_answer, user_question)
+        gevent.joinall([retrieval, generation], raise_error=True)
+        evidence_docs, evidence_embeddings = retrieval.value
+        raw_answer = generation.value
+
+        # 2. Detect
+        logger.info("Detecting hallucinations...")
+        detection_result = pipeline.detect(user_question, raw_answer, evidence_docs, evidence_embeddings)
         
         raw_answer = detection_result.get('raw_answer', "Error generating answer")
         is_hallucination = detection_result.get('is_hallucination', False)
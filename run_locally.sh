@@ -16,9 +16,17 @@ fi
 # Dependencies are assumed to be installed
 echo "[INFO] Skipping dependency check as requested."
 
-# Start Flask API in background
+# Start Flask API in background under gunicorn's gevent worker so slow
+# Gemini/Wikipedia calls don't serialize requests. The worker monkey-patches the
+# stdlib itself before importing api.py, so the app never patches on its own.
+# Each worker loads its own models, so keep the worker count low on machines
+# with limited memory. The working directory stays at the repo root so the log
+# DB and on-disk caches land in the same place as with `python "Frontend Code/api.py"`.
+# GUNICORN_WORKERS is exported so each worker sizes its torch thread pool to its share of the cores.
 echo "[INFO] Starting Flask API..."
-python "Frontend Code/api.py" &
+export GUNICORN_WORKERS="${GUNICORN_WORKERS:-2}"
+gunicorn -k gevent -w "$GUNICORN_WORKERS" --worker-connections 1000 \
+    --timeout 120 -b 127.0.0.1:5000 --pythonpath "Frontend Code" api:app &
 API_PID=$!
 
 # Wait a few seconds for API to initialize
@@ -0,0 +1,3 @@
+from .correction_module import correct_and_regenerate, calculate_confidence_score
+from .correction_module import initialize_database, log_hallucination_data
+__all__ = ['correct_and_regenerate', 'calculate_confidence_score', 'initialize_database', 'log_hallucination_data']
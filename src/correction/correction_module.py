@@ -1,8 +1,19 @@
 import sqlite3
 import os
+import re
+import hashlib
+import time
+import queue
+import atexit
+import threading
+import contextlib
+from collections import OrderedDict
+from concurrent.futures import Future
+import torch
 from langchain_google_genai import ChatGoogleGenerativeAI
-from langchain.chains import RetrievalQA
-from sentence_transformers import SentenceTransformer, util
+from langchain.chains.question_answering import load_qa_chain
+from langchain_core.documents import Document
+from sentence_transformers import SentenceTransformer
 from dotenv import load_dotenv
 
 load_dotenv()
@@ -10,89 +21,488 @@ load_dotenv()
 
 DATABASE_NAME = "hallucination_log.db"
 
+def _db_logging_disabled() -> bool:
+    return os.getenv("DISABLE_DB_LOGGING", "False").lower() == "true"
+
+_ST_MODEL = None
+_ST_MODEL_LOCK = threading.Lock()
+_ST_MODEL_NAME = 'all-MiniLM-L6-v2'
+_ST_BACKEND = os.getenv("ST_BACKEND", "torch").lower()
+_ST_MAX_SEQ_LENGTH = 256
+# Roughly _ST_MAX_SEQ_LENGTH tokens of English text; longer sources are split
+# so the tail isn't silently dropped by the tokenizer's truncation.
+_MAX_CHUNK_CHARS = 1000
+_SENTENCE_BOUNDARY = re.compile(r'(?<=[.!?])\s+')
+
+def _split_for_encoding(text: str) -> list:
+    text = text.strip()
+    if len(text) <= _MAX_CHUNK_CHARS:
+        return [text] if text else []
+    chunks = []
+    current = ""
+    for sentence in _SENTENCE_BOUNDARY.split(text):
+        # Runs without sentence punctuation (lists, tables) are cut into consecutive
+        # windows so nothing past the first _MAX_CHUNK_CHARS is lost.
+        for start in range(0, len(sentence), _MAX_CHUNK_CHARS):
+            piece = sentence[start:start + _MAX_CHUNK_CHARS]
+            if current and len(current) + 1 + len(piece) > _MAX_CHUNK_CHARS:
+                chunks.append(current)
+                current = piece
+            else:
+                current = f"{current} {piece}" if current else piece
+    if current:
+        chunks.append(current)
+    return chunks
+
+def _use_fp16() -> bool:
+    return _ST_BACKEND != "onnx" and torch.cuda.is_available()
+
+def _st_precision() -> str:
+    if _use_fp16():
+        return "fp16"
+    # The ONNX graph is loaded as exported; dynamic quantization only applies to torch.
+    if _ST_BACKEND != "onnx" and os.getenv("DISABLE_ST_QUANTIZATION", "False").lower() != "true":
+        return "qint8"
+    return "fp32"
+
+def _encoder_signature() -> str:
+    # Embeddings from different encoders (or the same one at different precisions)
+    # aren't comparable, so cached vectors are namespaced by how they were produced.
+    return f"{_ST_MODEL_NAME}:{_ST_BACKEND}:{_st_precision()}"
+
+def _encode_context():
+    if _use_fp16():
+        return torch.inference_mode(), torch.autocast('cuda', dtype=torch.float16)
+    return torch.inference_mode(), contextlib.nullcontext()
+
+def _load_onnx_st_model(device: str) -> SentenceTransformer:
+    import onnxruntime as ort
+
+    session_options = ort.SessionOptions()
+    session_options.graph_optimization_level = ort.GraphOptimizationLevel.ORT_ENABLE_ALL
+    session_options.intra_op_num_threads = os.cpu_count() or 1
+    provider = "CUDAExecutionProvider" if device == 'cuda' else "CPUExecutionProvider"
+    return SentenceTransformer(
+        _ST_MODEL_NAME,
+        device=device,
+        backend="onnx",
+        model_kwargs={"provider": provider, "session_options": session_options}
+    )
+
+def _get_st_model() -> SentenceTransformer:
+    global _ST_MODEL
+    if _ST_MODEL is None:
+        with _ST_MODEL_LOCK:
+            if _ST_MODEL is None:
+                device = 'cuda' if torch.cuda.is_available() else 'cpu'
+                if _ST_BACKEND == "onnx":
+                    model = _load_onnx_st_model(device)
+                else:
+                    model = SentenceTransformer(_ST_MODEL_NAME, device=device)
+                if _st_precision() == "qint8":
+                    # int8 linear layers roughly double CPU encode throughput for MiniLM.
+                    transformer = model[0]
+                    transformer.auto_model = torch.quantization.quantize_dynamic(
+                        transformer.auto_model, {torch.nn.Linear}, dtype=torch.qint8
+                    )
+                if _use_fp16():
+                    model.half()
+                model.max_seq_length = _ST_MAX_SEQ_LENGTH
+                _ST_MODEL = model
+    return _ST_MODEL
+
+_TOKEN_CACHE_SIZE = 4096
+_ENCODE_BATCH_SIZE = 32
+
+_TOK_CACHE = OrderedDict()
+_tok_cache_lock = threading.Lock()
+
+def _tokenize_cached(model: SentenceTransformer, texts: list) -> list:
+    keys = [hashlib.sha1(text.encode()).hexdigest() for text in texts]
+    features = {}
+    missing = OrderedDict()
+    with _tok_cache_lock:
+        for text, key in zip(texts, keys):
+            if key in _TOK_CACHE:
+                _TOK_CACHE.move_to_end(key)
+                features[key] = _TOK_CACHE[key]
+            else:
+                missing[key] = text
+
+    if missing:
+        encoded = model.tokenizer(list(missing.values()), truncation=True, max_length=model.max_seq_length)
+        with _tok_cache_lock:
+            for i, key in enumerate(missing):
+                features[key] = {name: values[i] for name, values in encoded.items()}
+                _TOK_CACHE[key] = features[key]
+            while len(_TOK_CACHE) > _TOKEN_CACHE_SIZE:
+                _TOK_CACHE.popitem(last=False)
+
+    return [features[key] for key in keys]
+
+def _encode_texts(model: SentenceTransformer, texts: list) -> torch.Tensor:
+    if _ST_BACKEND == "onnx":
+        return model.encode(texts, convert_to_tensor=True, batch_size=_ENCODE_BATCH_SIZE, normalize_embeddings=True)
+
+    # Feed cached token ids straight through the module stack (transformer,
+    # pooling) so repeated texts skip tokenization entirely.
+    tokenized = _tokenize_cached(model, texts)
+    embeddings = []
+    for start in range(0, len(tokenized), _ENCODE_BATCH_SIZE):
+        batch = model.tokenizer.pad(tokenized[start:start + _ENCODE_BATCH_SIZE], padding=True, return_tensors="pt")
+        batch = {name: tensor.to(model.device) for name, tensor in batch.items()}
+        embeddings.append(model(batch)["sentence_embedding"])
+    return torch.nn.functional.normalize(torch.cat(embeddings), p=2, dim=1)
+
+class ChunkEmbeddingStore:
+    def __init__(self):
+        self._table_ready = False
+
+    def _ensure_table(self, conn: sqlite3.Connection):
+        if not self._table_ready:
+            conn.execute("""
+                CREATE TABLE IF NOT EXISTS chunk_embeddings (
+                    hash TEXT PRIMARY KEY,
+                    embedding BLOB NOT NULL
+                )
+            """)
+            self._table_ready = True
+
+    def load(self, keys: list) -> dict:
+        if not keys:
+            return {}
+        conn = _get_db_conn()
+        placeholders = ", ".join("?" for _ in keys)
+        with _db_lock:
+            self._ensure_table(conn)
+            rows = conn.execute(
+                f"SELECT hash, embedding FROM chunk_embeddings WHERE hash IN ({placeholders})", keys
+            ).fetchall()
+        return {key: torch.frombuffer(bytearray(blob), dtype=torch.float32) for key, blob in rows}
+
+    def save(self, items: dict):
+        if not items:
+            return
+        rows = [(key, embedding.detach().float().cpu().numpy().tobytes()) for key, embedding in items.items()]
+        conn = _get_db_conn()
+        with _db_lock:
+            self._ensure_table(conn)
+            try:
+                conn.execute("BEGIN")
+                conn.executemany("INSERT OR REPLACE INTO chunk_embeddings (hash, embedding) VALUES (?, ?)", rows)
+                conn.execute("COMMIT")
+            except sqlite3.Error:
+                if conn.in_transaction:
+                    conn.execute("ROLLBACK")
+                raise
+
+class EmbeddingCache:
+    def __init__(self, max_entries: int = 10000, ttl_seconds: float = 3600.0, store: ChunkEmbeddingStore = None):
+        self.max_entries = max_entries
+        self.ttl_seconds = ttl_seconds
+        self.store = store
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def _key(text: str) -> str:
+        return hashlib.sha256(f"{_encoder_signature()}\0{text}".encode()).hexdigest()
+
+    def get(self, key: str):
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                return None
+            embedding, stored_at = entry
+            if time.monotonic() - stored_at > self.ttl_seconds:
+                del self._entries[key]
+                return None
+            self._entries.move_to_end(key)
+            return embedding
+
+    def put(self, key: str, embedding: torch.Tensor):
+        with self._lock:
+            self._entries[key] = (embedding, time.monotonic())
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+
+    def _load_persistent(self, keys: list) -> dict:
+        if self.store is None or not keys or _db_logging_disabled():
+            return {}
+        try:
+            device = _get_st_model().device
+            dtype = torch.float16 if _use_fp16() else torch.float32
+            return {key: embedding.to(device=device, dtype=dtype) for key, embedding in self.store.load(keys).items()}
+        except sqlite3.Error as e:
+            print(f"Database error while loading embeddings: {e}")
+            return {}
+
+    def _save_persistent(self, items: dict):
+        if self.store is None or not items or _db_logging_disabled():
+            return
+        try:
+            self.store.save(items)
+        except sqlite3.Error as e:
+            print(f"Database error while saving embeddings: {e}")
+
+    def embed(self, texts: list, persistent_texts: list = ()) -> torch.Tensor:
+        persistent_texts = set(persistent_texts)
+        keys = [self._key(text) for text in texts]
+        embeddings = {}
+        missing = OrderedDict()
+        for text, key in zip(texts, keys):
+            if key in embeddings or key in missing:
+                continue
+            embedding = self.get(key)
+            if embedding is None:
+                missing[key] = text
+            else:
+                embeddings[key] = embedding
+
+        persistent_keys = [key for key, text in missing.items() if text in persistent_texts]
+        for key, embedding in self._load_persistent(persistent_keys).items():
+            self.put(key, embedding)
+            embeddings[key] = embedding
+            del missing[key]
+
+        if missing:
+            model = _get_st_model()
+            inference_mode, autocast = _encode_context()
+            with inference_mode, autocast:
+                encoded = _encode_texts(model, list(missing.values()))
+            for key, embedding in zip(missing, encoded):
+                self.put(key, embedding)
+                embeddings[key] = embedding
+            self._save_persistent({
+                key: embeddings[key] for key, text in missing.items() if text in persistent_texts
+            })
+
+        return torch.stack([embeddings[key] for key in keys])
+
+_embedding_cache = EmbeddingCache(store=ChunkEmbeddingStore())
+
+_db_conn = None
+_db_lock = threading.Lock()
+
+def _get_db_conn() -> sqlite3.Connection:
+    global _db_conn
+    if _db_conn is None:
+        with _db_lock:
+            if _db_conn is None:
+                conn = sqlite3.connect(DATABASE_NAME, check_same_thread=False, isolation_level=None)
+                conn.execute("PRAGMA journal_mode=WAL")
+                conn.execute("PRAGMA synchronous=NORMAL")
+                _db_conn = conn
+    return _db_conn
+
+# Kept as a single constant so sqlite3's statement cache reuses the compiled
+# INSERT for every batch instead of re-parsing it.
+INSERT_LOG_SQL = (
+    "INSERT INTO logs (Question, RawAnswer, CorrectedAnswer, Citations, ConfidenceScore) "
+    "VALUES (?, ?, ?, ?, ?)"
+)
+
+_LOG_BATCH_SIZE = 64
+_LOG_BATCH_WAIT = 0.05
+
+_log_queue = queue.Queue()
+_log_writer = None
+_log_writer_lock = threading.Lock()
+
+def _write_log_batch(rows: list):
+    conn = _get_db_conn()
+    with _db_lock:
+        try:
+            conn.execute("BEGIN")
+            conn.executemany(INSERT_LOG_SQL, rows)
+            conn.execute("COMMIT")
+            print(f"Successfully logged {len(rows)} row(s) to database.")
+        except sqlite3.Error as e:
+            if conn.in_transaction:
+                conn.execute("ROLLBACK")
+            print(f"Database error: {e}")
+
+def _writer_loop():
+    while True:
+        rows = [_log_queue.get()]
+        try:
+            while len(rows) < _LOG_BATCH_SIZE:
+                rows.append(_log_queue.get(timeout=_LOG_BATCH_WAIT))
+        except queue.Empty:
+            pass
+        try:
+            _write_log_batch(rows)
+        except Exception as e:
+            print(f"Database error: {e}")
+        finally:
+            for _ in rows:
+                _log_queue.task_done()
+
+def _ensure_log_writer():
+    global _log_writer
+    if _log_writer is None:
+        with _log_writer_lock:
+            if _log_writer is None:
+                _log_writer = threading.Thread(target=_writer_loop, name="log-writer", daemon=True)
+                _log_writer.start()
+                atexit.register(_log_queue.join)
+
 def initialize_database():
-    conn = sqlite3.connect(DATABASE_NAME)
-    cursor = conn.cursor()
-    cursor.execute("""
-        CREATE TABLE IF NOT EXISTS logs (
-            id INTEGER PRIMARY KEY AUTOINCREMENT,
-            timestamp DATETIME DEFAULT CURRENT_TIMESTAMP,
-            Question TEXT NOT NULL,
-            RawAnswer TEXT NOT NULL,
-            CorrectedAnswer TEXT,
-            Citations TEXT,
-            ConfidenceScore REAL
-        )
-    """)
-    conn.commit()
-    conn.close()
+    conn = _get_db_conn()
+    with _db_lock:
+        conn.execute("""
+            CREATE TABLE IF NOT EXISTS logs (
+                id INTEGER PRIMARY KEY,
+                timestamp DATETIME DEFAULT CURRENT_TIMESTAMP,
+                Question TEXT NOT NULL,
+                RawAnswer TEXT NOT NULL,
+                CorrectedAnswer TEXT,
+                Citations TEXT,
+                ConfidenceScore REAL
+            )
+        """)
+        conn.execute("CREATE INDEX IF NOT EXISTS idx_logs_question ON logs(Question)")
+        conn.execute("CREATE INDEX IF NOT EXISTS idx_logs_timestamp ON logs(timestamp)")
 
 def calculate_confidence_score(corrected_answer: str, source_documents: list) -> float:
     if not source_documents:
         return 0.0
 
-    model = SentenceTransformer('all-MiniLM-L6-v2')
-    answer_embedding = model.encode(corrected_answer, convert_to_tensor=True)
-
-   
-    source_contents = [doc.page_content for doc in source_documents]
+    # Long sources are scored per sub-chunk; the max below picks the best one.
+    source_contents = [chunk for doc in source_documents for chunk in _split_for_encoding(doc.page_content)]
     if not source_contents: 
         return 0.0
-    
-    source_embeddings = model.encode(source_contents, convert_to_tensor=True)
 
-   
-    cosine_scores = util.cos_sim(answer_embedding, source_embeddings)
-    
-   
-    return round(float(cosine_scores.max()), 4)
+    embeddings = _embedding_cache.embed([corrected_answer] + source_contents, persistent_texts=source_contents)
+    answer_embedding, source_embeddings = embeddings[:1], embeddings[1:]
+
+    # Embeddings are unit-length, so the dot product is the cosine similarity.
+    # Reduce on-device so only the final scalar is copied back to the host.
+    max_score = torch.matmul(source_embeddings, answer_embedding.T).amax().item()
+
+    return round(max_score, 4)
 
 def log_hallucination_data(question: str, raw_answer: str, corrected_answer: str, citations: list, confidence_score: float):
-    if os.getenv("DISABLE_DB_LOGGING", "False").lower() == "true":
+    if _db_logging_disabled():
         print("Database logging disabled via environment variable.")
         return
 
-    conn = sqlite3.connect(DATABASE_NAME)
-    cursor = conn.cursor()
-    try:
-       
-        citations_str = "; ".join(citations)
-        cursor.execute("""
-            INSERT INTO logs (Question, RawAnswer, CorrectedAnswer, Citations, ConfidenceScore)
-            VALUES (?, ?, ?, ?, ?)
-        """, (question, raw_answer, corrected_answer, citations_str, confidence_score))
-        conn.commit()
-        print("Successfully logged data to database.")
-    except sqlite3.Error as e:
-        print(f"Database error: {e}")
-    finally:
-        conn.close()
+    citations_str = "; ".join(citations)
+    _ensure_log_writer()
+    _log_queue.put((question, raw_answer, corrected_answer, citations_str, confidence_score))
+
+_LLM = None
+_STUFF_CHAIN = None
+_chain_lock = threading.Lock()
+
+def _get_stuff_chain():
+    global _LLM, _STUFF_CHAIN
+    if _STUFF_CHAIN is None:
+        with _chain_lock:
+            if _STUFF_CHAIN is None:
+                _LLM = ChatGoogleGenerativeAI(model="gemini-2.5-flash", temperature=0.0, google_api_key=os.getenv("GEMINI_API_KEY"))
+                _STUFF_CHAIN = load_qa_chain(_LLM, chain_type="stuff")
+    return _STUFF_CHAIN
+
+class ChainBatcher:
+    def __init__(self, max_batch_size: int = 16, max_wait: float = 0.025):
+        self.max_batch_size = max_batch_size
+        self.max_wait = max_wait
+        self._queue = queue.Queue()
+        self._worker = None
+        self._worker_lock = threading.Lock()
+
+    def _ensure_worker(self):
+        if self._worker is None:
+            with self._worker_lock:
+                if self._worker is None:
+                    self._worker = threading.Thread(target=self._run, name="chain-batcher", daemon=True)
+                    self._worker.start()
+
+    def submit(self, inputs: dict) -> Future:
+        self._ensure_worker()
+        future = Future()
+        self._queue.put((inputs, future))
+        return future
+
+    def invoke(self, inputs: dict) -> dict:
+        return self.submit(inputs).result()
+
+    def _collect_batch(self) -> list:
+        batch = [self._queue.get()]
+        deadline = time.monotonic() + self.max_wait
+        while len(batch) < self.max_batch_size:
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                break
+            try:
+                batch.append(self._queue.get(timeout=remaining))
+            except queue.Empty:
+                break
+        return batch
+
+    def _run(self):
+        while True:
+            batch = self._collect_batch()
+            try:
+                outputs = _get_stuff_chain().batch([inputs for inputs, _ in batch], return_exceptions=True)
+            except Exception as e:
+                outputs = [e] * len(batch)
+            for (_, future), output in zip(batch, outputs):
+                if isinstance(output, Exception):
+                    future.set_exception(output)
+                else:
+                    future.set_result(output)
+
+_chain_batcher = ChainBatcher()
+
+_ANSWER_CACHE_SIZE = 256
+
+_answer_cache = OrderedDict()
+_answer_cache_lock = threading.Lock()
+
+def _evidence_signature(question: str, evidence: list) -> str:
+    return hashlib.sha1(("\n".join(sorted(evidence)) + "|" + question).encode()).hexdigest()
+
+def _get_cached_answer(signature: str):
+    with _answer_cache_lock:
+        cached = _answer_cache.get(signature)
+        if cached is not None:
+            _answer_cache.move_to_end(signature)
+        return cached
+
+def _cache_answer(signature: str, result: dict):
+    with _answer_cache_lock:
+        _answer_cache[signature] = result
+        _answer_cache.move_to_end(signature)
+        while len(_answer_cache) > _ANSWER_CACHE_SIZE:
+            _answer_cache.popitem(last=False)
+
+def _dedupe_evidence(evidence: list) -> list:
+    seen = set()
+    unique = []
+    for doc in evidence:
+        digest = hashlib.sha1(doc.strip().lower().encode()).hexdigest()
+        if digest not in seen:
+            seen.add(digest)
+            unique.append(doc)
+    return unique
 
 def correct_and_regenerate(question: str, raw_answer: str, evidence: list) -> dict:
-   
-    llm = ChatGoogleGenerativeAI(model="gemini-2.5-flash", temperature=0.0, google_api_key=os.getenv("GEMINI_API_KEY"))
+    evidence = _dedupe_evidence(evidence)
+    signature = _evidence_signature(question, evidence)
+    cached = _get_cached_answer(signature)
+    if cached is not None:
+        print(f"Answer cache hit for question: {question}")
+        log_hallucination_data(question, raw_answer, cached["CorrectedAnswer"], cached["Citations"], cached["ConfidenceScore"])
+        return {**cached, "Citations": list(cached["Citations"])}
 
-   
-    from langchain_core.retrievers import BaseRetriever
-    class MockRetriever(BaseRetriever):
-        def _get_relevant_documents(self, query):
-           
-            from langchain.docstore.document import Document
-            return [Document(page_content=doc) for doc in evidence]
-
-    mock_retriever = MockRetriever()
-
-    qa_chain = RetrievalQA.from_chain_type(
-        llm=llm,
-        chain_type="stuff",  
-        retriever=mock_retriever, 
-        return_source_documents=True
-    )
+    source_documents = [Document(page_content=doc) for doc in evidence]
 
-    
-    response = qa_chain.invoke({"query": question})
-    corrected_answer = response["result"]
-    source_documents = response["source_documents"]
+    # Concurrent requests are grouped into a single chain.batch call.
+    response = _chain_batcher.invoke({"input_documents": source_documents, "question": question})
+    corrected_answer = response["output_text"]
 
     
     citations_list = []
@@ -102,7 +512,7 @@ def correct_and_regenerate(question: str, raw_answer: str, evidence: list) -> di
         else:
             
             citations_list.append(doc.page_content[:50] + "...")
-    citations = list(set(citations_list))
+    citations = list(dict.fromkeys(citations_list))
     
     
     confidence_score = calculate_confidence_score(corrected_answer, source_documents)
@@ -113,11 +523,13 @@ def correct_and_regenerate(question: str, raw_answer: str, evidence: list) -> di
     print(f"Received question: {question}")
     print(f"Received raw answer: {raw_answer}")
     print(f"Received evidence: {evidence}")
-    return {
+    result = {
         "CorrectedAnswer": corrected_answer,
         "Citations": citations,
         "ConfidenceScore": confidence_score
     }
+    _cache_answer(signature, {**result, "Citations": list(citations)})
+    return result
 
 if __name__ == "__main__":
    
@@ -1,22 +1,51 @@
 from __future__ import annotations
 
+import os
+import math
+import hashlib
+import threading
+from collections import OrderedDict
+from copy import deepcopy
 import numpy as np
-from typing import List, Tuple, Dict, Any
-from sentence_transformers import SentenceTransformer, util
+from functools import lru_cache
+from typing import List, Tuple, Dict, Any, Optional
+from sentence_transformers import SentenceTransformer
 from transformers import AutoTokenizer, AutoModelForSequenceClassification
 import logging
 import torch
-from nltk.tokenize import sent_tokenize
-import nltk
+
+from src.utils.nlp import load_punkt_tokenizer
+from src.utils.torch_utils import fp16_autocast
 
 logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(name)s - %(levelname)s - %(message)s')
 logger = logging.getLogger(__name__)
 
-try:
-    nltk.data.find('tokenizers/punkt')
-except LookupError:
-    logger.info("NLTK 'punkt' resource not found. Downloading...")
-    nltk.download('punkt')
+_PUNKT_TOKENIZER = load_punkt_tokenizer()
+
+@lru_cache(maxsize=1024)
+def _tokenize_doc(doc: str) -> Tuple[str, ...]:
+    return tuple(sent for sent in _PUNKT_TOKENIZER.tokenize(doc) if sent.strip())
+
+NLI_MAX_LENGTH = 512
+
+def _log_odds(probability: float) -> float:
+    if probability <= 0.0:
+        return -math.inf
+    if probability >= 1.0:
+        return math.inf
+    return math.log(probability / (1.0 - probability))
+
+def _sigmoid(log_odds: float) -> float:
+    if log_odds >= 0:
+        return 1.0 / (1.0 + math.exp(-log_odds))
+    odds = math.exp(log_odds)
+    return odds / (1.0 + odds)
+
+def _class_log_odds(logits: torch.Tensor, class_idx: int) -> torch.Tensor:
+    # log(p / (1 - p)) for one class, straight from the logits: softmax(x)[c] > t
+    # exactly when x[c] - logsumexp(x[others]) > log(t / (1 - t)).
+    other_logits = torch.cat([logits[..., :class_idx], logits[..., class_idx + 1:]], dim=-1)
+    return logits[..., class_idx] - torch.logsumexp(other_logits, dim=-1)
 
 
 class DetectionResult:
@@ -44,32 +73,78 @@ class HallucinationDetector:
 
     def __init__(self,
                  similarity_model: str = "all-MiniLM-L6-v2",
-                 nli_model: str = "roberta-large-mnli",
+                 nli_model: str = "cross-encoder/nli-distilroberta-base",
                  similarity_threshold: float = 0.5,
                  contradiction_threshold: float = 0.98,
                  entailment_threshold: float = 0.92,
-                 device: str = "cpu"):
+                 device: str = "cpu",
+                 nli_batch_size: int = 32,
+                 nli_top_k: int = 16,
+                 compile_nli: bool = False,
+                 backend: str = "torch",
+                 onnx_cache_dir: str = "./onnx_cache",
+                 result_cache_size: int = 256):
 
         self.similarity_model_name = similarity_model
         self.nli_model_name = nli_model
         self.similarity_threshold = similarity_threshold
         self.contradiction_threshold = contradiction_threshold
         self.entailment_threshold = entailment_threshold
-        self.device = torch.device(device if torch.cuda.is_available() else "cpu")
+        self.nli_batch_size = nli_batch_size
+        self.nli_top_k = nli_top_k
+        self.compile_nli = compile_nli
+        self.backend = backend
+        self.onnx_cache_dir = onnx_cache_dir
+        self.result_cache_size = result_cache_size
+        self._cache = OrderedDict()
+        self._cache_lock = threading.Lock()
+        # The optimized ONNX graphs target the CPU execution provider.
+        use_cuda = torch.cuda.is_available() and backend != "onnx"
+        self.device = torch.device(device if use_cuda else "cpu")
+        # The detector is shared across request threads, and the NLI input buffers
+        # allocated in _load_models are reused between calls.
+        self._nli_lock = threading.Lock()
         self._load_models(similarity_model, nli_model)
 
-        self.CONTRADICTION_INDEX = 0
-        self.ENTAILMENT_INDEX = 2
-
     def _load_models(self, similarity_model_name: str, nli_model_name: str):
         try:
+            if self.device.type == "cpu":
+                self._configure_cpu_threads()
+
             logger.info(f"Loading semantic similarity model: {similarity_model_name}")
-            self.similarity_model = SentenceTransformer(similarity_model_name, device=self.device)
+            if self.backend == "onnx":
+                self.similarity_model = SentenceTransformer(similarity_model_name, device=self.device, backend="onnx")
+            else:
+                self.similarity_model = SentenceTransformer(similarity_model_name, device=self.device)
 
             logger.info(f"Loading NLI model: {nli_model_name}")
-            self.nli_tokenizer = AutoTokenizer.from_pretrained(nli_model_name)
-            self.nli_model = AutoModelForSequenceClassification.from_pretrained(nli_model_name).to(self.device)
-            self.nli_model.eval()
+            self.nli_tokenizer = AutoTokenizer.from_pretrained(nli_model_name, use_fast=True)
+            self._allocate_nli_buffers()
+            if self.backend == "onnx":
+                self.nli_model = self._load_onnx_nli_model(nli_model_name)
+            else:
+                self.nli_model = AutoModelForSequenceClassification.from_pretrained(nli_model_name).to(self.device)
+                self.nli_model.eval()
+                self.similarity_model.eval()
+                for param in self.nli_model.parameters():
+                    param.requires_grad_(False)
+                if self.device.type == "cuda":
+                    self.nli_model = self.nli_model.half()
+                    self.similarity_model.half()
+
+            # Label order differs between NLI checkpoints, so read it from the config.
+            label_to_index = {label.lower(): int(idx) for idx, label in self.nli_model.config.id2label.items()}
+            missing = [label for label in ("contradiction", "entailment") if label not in label_to_index]
+            if missing:
+                raise ValueError(
+                    f"NLI model {nli_model_name} does not name its {' and '.join(missing)} label(s) in id2label "
+                    f"(got {sorted(label_to_index)}); use a checkpoint with named NLI labels."
+                )
+            self.CONTRADICTION_INDEX = label_to_index["contradiction"]
+            self.ENTAILMENT_INDEX = label_to_index["entailment"]
+
+            if self.compile_nli and self.backend != "onnx":
+                self._compile_nli_model()
 
             logger.info("Models loaded successfully!")
 
@@ -77,61 +152,260 @@ class HallucinationDetector:
             logger.error(f"Error loading models: {e}")
             raise
 
-    def detect_hallucination(self, answer: str, evidence_docs: List[str]) -> DetectionResult:
+    def _configure_cpu_threads(self):
+        # OMP_NUM_THREADS / MKL_NUM_THREADS size torch's intra-op pool at startup. If the
+        # user set either one, respect it; otherwise split every core but one between the
+        # gunicorn workers, since each worker process runs its own copy of the models.
+        if not (os.getenv("OMP_NUM_THREADS") or os.getenv("MKL_NUM_THREADS")):
+            workers = max(1, int(os.getenv("GUNICORN_WORKERS") or 1))
+            torch.set_num_threads(max(1, ((os.cpu_count() or 1) - 1) // workers))
+        try:
+            torch.set_num_interop_threads(2)
+        except RuntimeError:
+            # Only settable before the first inter-op parallel region runs.
+            pass
+        torch.backends.mkldnn.enabled = True
+        logger.info(f"CPU inference using {torch.get_num_threads()} intra-op threads.")
+
+    def _allocate_nli_buffers(self):
+        # input_ids, attention_mask (and token_type_ids) share one flat buffer sized for the
+        # largest mini-batch; each batch takes a contiguous (fields, batch, seq_len) view.
+        self._nli_fields = 3 if "token_type_ids" in self.nli_tokenizer.model_input_names else 2
+        buffer_size = self._nli_fields * self.nli_batch_size * NLI_MAX_LENGTH
+        # Batches are padded on the host. On CUDA that happens in a pinned staging buffer
+        # so the whole batch goes up in a single asynchronous copy.
+        on_cuda = self.device.type == "cuda"
+        self._nli_host_buf = torch.empty(buffer_size, dtype=torch.long, pin_memory=on_cuda)
+        self._nli_device_buf = torch.empty(buffer_size, dtype=torch.long, device=self.device) if on_cuda else self._nli_host_buf
+        self._nli_upload_done = None
+
+    def _stage_nli_batch(self, batch: list, seq_len: int, pad_id: int) -> Dict[str, torch.Tensor]:
+        shape = (self._nli_fields, len(batch), seq_len)
+        size = math.prod(shape)
+        if self._nli_upload_done is not None:
+            # The previous batch's copy may still be reading the staging buffer.
+            self._nli_upload_done.synchronize()
+        host = self._nli_host_buf[:size].view(shape).numpy()
+        host[0].fill(pad_id)
+        host[1:].fill(0)
+        for r, encoding in enumerate(batch):
+            length = len(encoding)
+            host[0, r, :length] = encoding.ids
+            host[1, r, :length] = encoding.attention_mask
+            if self._nli_fields == 3:
+                host[2, r, :length] = encoding.type_ids
+
+        device_view = self._nli_device_buf[:size].view(shape)
+        if self._nli_device_buf is not self._nli_host_buf:
+            device_view.copy_(self._nli_host_buf[:size].view(shape), non_blocking=True)
+            self._nli_upload_done = torch.cuda.Event()
+            self._nli_upload_done.record()
+
+        model_inputs = {"input_ids": device_view[0], "attention_mask": device_view[1]}
+        if self._nli_fields == 3:
+            model_inputs["token_type_ids"] = device_view[2]
+        return model_inputs
+
+    def _load_onnx_nli_model(self, nli_model_name: str):
+        from optimum.onnxruntime import ORTModelForSequenceClassification, ORTOptimizer, ORTQuantizer
+        from optimum.onnxruntime.configuration import AutoQuantizationConfig, OptimizationConfig
+
+        cache_dir = os.path.join(self.onnx_cache_dir, nli_model_name.replace("/", "__"))
+        quantized_file = "model_optimized_quantized.onnx"
+        if not os.path.exists(os.path.join(cache_dir, quantized_file)):
+            logger.info(f"Exporting {nli_model_name} to ONNX (fused graph + dynamic INT8) in {cache_dir}")
+            exported_model = ORTModelForSequenceClassification.from_pretrained(nli_model_name, export=True)
+            optimizer = ORTOptimizer.from_pretrained(exported_model)
+            optimizer.optimize(save_dir=cache_dir, optimization_config=OptimizationConfig(optimization_level=99))
+            quantizer = ORTQuantizer.from_pretrained(cache_dir, file_name="model_optimized.onnx")
+            quantizer.quantize(save_dir=cache_dir, quantization_config=AutoQuantizationConfig.avx2(is_static=False))
+
+        return ORTModelForSequenceClassification.from_pretrained(cache_dir, file_name=quantized_file)
+
+    def _compile_nli_model(self):
+        if not hasattr(torch, "compile"):
+            logger.warning("torch.compile is not available (PyTorch < 2.0). Running NLI model eagerly.")
+            return
+        try:
+            compiled_model = torch.compile(self.nli_model, mode="reduce-overhead", dynamic=True)
+            # Compilation happens lazily on the first call; warm up here so failures fall back to eager.
+            warmup_input = self.nli_tokenizer([("Warmup premise.", "Warmup hypothesis.")], return_tensors="pt").to(self.device)
+            with torch.inference_mode(), fp16_autocast(self.device):
+                compiled_model(**warmup_input)
+            self.nli_model = compiled_model
+            logger.info("NLI model compiled with torch.compile.")
+        except Exception as e:
+            logger.warning(f"torch.compile failed, running NLI model eagerly: {e}")
+
+    def _encode_nli_pairs(self, premises: List[str], hypotheses: List[str], pair_idxs: List[Tuple[int, int]]) -> list:
+        # An evidence sentence is shortlisted for many claims, so run the fast tokenizer
+        # once per sentence without special tokens and splice each pair together from
+        # the cached encodings with the tokenizer's own post-processor.
+        tokenizer = self.nli_tokenizer
+        post_processor = tokenizer.backend_tokenizer.post_processor
+        premise_encodings = tokenizer(premises, add_special_tokens=False).encodings
+        hypothesis_encodings = tokenizer(hypotheses, add_special_tokens=False).encodings
+        budget = NLI_MAX_LENGTH - tokenizer.num_special_tokens_to_add(pair=True)
+
+        encodings = []
+        for premise_idx, hypothesis_idx in pair_idxs:
+            premise, hypothesis = premise_encodings[premise_idx], hypothesis_encodings[hypothesis_idx]
+            if post_processor is not None and len(premise) + len(hypothesis) <= budget:
+                encodings.append(post_processor.process(premise, hypothesis))
+            else:
+                # Rare over-long pairs go back through the tokenizer so it applies its own truncation.
+                encodings.append(tokenizer(premises[premise_idx], hypotheses[hypothesis_idx], truncation=True, max_length=NLI_MAX_LENGTH).encodings[0])
+        return encodings
+
+    def _nli_logits(self, premises: List[str], hypotheses: List[str], pair_idxs: List[Tuple[int, int]]) -> torch.Tensor:
+        encodings = self._encode_nli_pairs(premises, hypotheses, pair_idxs)
+        pad_id = self.nli_tokenizer.pad_token_id or 0
+
+        # Sort pairs by token length so each mini-batch only pads to its own longest pair,
+        # then scatter the logits back into the original pair order.
+        order = np.argsort([len(encoding) for encoding in encodings], kind="stable")
+
+        batch_logits = []
+        with self._nli_lock:
+            for start in range(0, len(order), self.nli_batch_size):
+                batch = [encodings[i] for i in order[start:start + self.nli_batch_size]]
+                seq_len = len(batch[-1])
+                model_inputs = self._stage_nli_batch(batch, seq_len, pad_id)
+                with torch.inference_mode(), fp16_autocast(self.device):
+                    batch_logits.append(self.nli_model(**model_inputs).logits)
+
+        # Upcast so log-odds near the 0.98 threshold aren't computed in fp16.
+        sorted_logits = torch.cat(batch_logits).float()
+        logits = torch.empty_like(sorted_logits)
+        logits[torch.as_tensor(order, device=sorted_logits.device)] = sorted_logits
+        return logits
+
+    @staticmethod
+    def _cache_key(answer: str, evidence_docs: List[str]) -> str:
+        digest = hashlib.blake2b(digest_size=16)
+        for text in (answer, *evidence_docs):
+            digest.update(text.encode("utf-8"))
+            digest.update(b"\x00")
+        return digest.hexdigest()
+
+    @staticmethod
+    def _evidence_sentences(evidence_docs: List[str]) -> np.ndarray:
+        # Retrieved documents often overlap; dedupe sentences (keeping first-seen order)
+        # so identical evidence isn't embedded and NLI-scored more than once.
+        return np.asarray(
+            list(dict.fromkeys(sent.strip() for doc in evidence_docs for sent in _tokenize_doc(doc))),
+            dtype=object,
+        )
+
+    def _encode(self, texts: List[str]) -> torch.Tensor:
+        with torch.inference_mode(), fp16_autocast(self.device):
+            return self.similarity_model.encode(texts, convert_to_tensor=True, normalize_embeddings=True, batch_size=64)
+
+    def encode_evidence(self, evidence_docs: List[str]) -> Optional[torch.Tensor]:
+        # Lets callers embed the evidence while the answer is still being generated,
+        # then hand the result to detect_hallucination(evidence_embeddings=...).
+        evidence_sentences = self._evidence_sentences(evidence_docs)
+        if evidence_sentences.size == 0:
+            return None
+        return self._encode(evidence_sentences.tolist())
+
+    def detect_hallucination(self, answer: str, evidence_docs: List[str],
+                             evidence_embeddings: Optional[torch.Tensor] = None) -> DetectionResult:
+        # Repeated questions usually come back with the same answer and evidence, so
+        # reuse the earlier verdict instead of re-running the embedding and NLI passes.
+        key = self._cache_key(answer, evidence_docs)
+        with self._cache_lock:
+            cached = self._cache.get(key)
+            if cached is not None:
+                self._cache.move_to_end(key)
+        if cached is not None:
+            return DetectionResult(**deepcopy(cached))
+
+        result = self._detect(answer, evidence_docs, evidence_embeddings)
+        with self._cache_lock:
+            self._cache[key] = deepcopy(result.to_dict())
+            self._cache.move_to_end(key)
+            while len(self._cache) > self.result_cache_size:
+                self._cache.popitem(last=False)
+        return result
+
+    def _detect(self, answer: str, evidence_docs: List[str],
+                evidence_embeddings: Optional[torch.Tensor] = None) -> DetectionResult:
         if not answer.strip():
             return DetectionResult(False, 1.0, "empty_answer", answer, evidence_docs, details={"reason": "Answer was empty."})
 
         if not evidence_docs:
             return DetectionResult(True, 1.0, "no_evidence", answer, [], details={"reason": "No evidence documents were provided."})
 
-        answer_claims = sent_tokenize(answer)
-        all_evidence_sentences = [sent for doc in evidence_docs for sent in sent_tokenize(doc) if sent.strip()]
+        answer_claims = _PUNKT_TOKENIZER.tokenize(answer)
+        all_evidence_sentences = self._evidence_sentences(evidence_docs)
 
-        if not all_evidence_sentences:
+        if all_evidence_sentences.size == 0:
             return DetectionResult(True, 1.0, "no_evidence", answer, evidence_docs, details={"reason": "Evidence documents contain no text."})
 
-        for claim in answer_claims:
-            nli_pairs = [(evidence_sent, claim) for evidence_sent in all_evidence_sentences]
+        # Evidence is the same for every claim: encode it, and all claims, once.
+        claim_embeddings = self._encode(answer_claims)
+        if evidence_embeddings is None:
+            evidence_embeddings = self._encode(all_evidence_sentences.tolist())
+        # Both sides are unit-length, so a single matmul gives the cosine similarities.
+        similarity_matrix = claim_embeddings.float() @ evidence_embeddings.float().T
+        max_similarity_scores, closest_evidence_idxs = torch.max(similarity_matrix, dim=1)
 
-            if not nli_pairs:
-                continue
+        # NLI is far more expensive per pair than embedding, so only the evidence
+        # sentences most similar to each claim are scored with it.
+        top_k = min(self.nli_top_k, all_evidence_sentences.size)
+        top_evidence_idxs = similarity_matrix.topk(top_k, dim=1).indices
 
-            tokenized_input = self.nli_tokenizer(nli_pairs, padding=True, truncation=True, return_tensors="pt", max_length=512).to(self.device)
+        # Score every shortlisted (evidence, claim) pair in one batched pass, then walk
+        # the claims in order so the first failing claim still decides the verdict.
+        nli_pair_idxs = [
+            (evidence_idx, claim_idx)
+            for claim_idx, evidence_idxs in enumerate(top_evidence_idxs.tolist())
+            for evidence_idx in evidence_idxs
+        ]
+        logits = self._nli_logits(all_evidence_sentences.tolist(), answer_claims, nli_pair_idxs)
 
-            with torch.no_grad():
-                logits = self.nli_model(**tokenized_input).logits
+        # Thresholds are applied in log-odds space, so no softmax is needed over the
+        # pairs; only a reported contradiction score is mapped back to a probability.
+        logits = logits.view(len(answer_claims), top_k, -1)
+        max_entailment_log_odds, _ = torch.max(_class_log_odds(logits, self.ENTAILMENT_INDEX), dim=1)
+        max_contradiction_log_odds, max_contradiction_pos = torch.max(_class_log_odds(logits, self.CONTRADICTION_INDEX), dim=1)
+        max_contradiction_idxs = top_evidence_idxs.gather(1, max_contradiction_pos.to(top_evidence_idxs.device).unsqueeze(1)).squeeze(1)
 
-            all_probs = torch.softmax(logits, dim=1)
-            entailment_probs = all_probs[:, self.ENTAILMENT_INDEX]
-            contradiction_probs = all_probs[:, self.CONTRADICTION_INDEX]
+        # Pull every per-claim statistic to the host in one transfer instead of
+        # syncing the device with an .item() call per claim.
+        claim_stats = torch.stack([
+            max_entailment_log_odds,
+            max_contradiction_log_odds,
+            max_contradiction_idxs.to(max_entailment_log_odds.dtype),
+            max_similarity_scores,
+            closest_evidence_idxs.to(max_entailment_log_odds.dtype),
+        ], dim=1).cpu().tolist()
 
-            max_entailment_score, _ = torch.max(entailment_probs, dim=0)
-            if max_entailment_score.item() > self.entailment_threshold:
+        entailment_cutoff = _log_odds(self.entailment_threshold)
+        contradiction_cutoff = _log_odds(self.contradiction_threshold)
+
+        for claim, (max_entailment_log_odds, max_contradiction_log_odds, max_contradiction_idx, max_similarity_score, closest_evidence_idx) in zip(answer_claims, claim_stats):
+            if max_entailment_log_odds > entailment_cutoff:
                 logger.info(f"Claim successfully verified by NLI entailment: '{claim}'")
                 continue
 
-            max_contradiction_score, max_contradiction_idx = torch.max(contradiction_probs, dim=0)
-            if max_contradiction_score.item() > self.contradiction_threshold:
+            if max_contradiction_log_odds > contradiction_cutoff:
+                max_contradiction_score = _sigmoid(max_contradiction_log_odds)
                 details = {
                     "problem_claim": claim,
-                    "contradictory_evidence": all_evidence_sentences[max_contradiction_idx],
-                    "contradiction_score": max_contradiction_score.item(),
+                    "contradictory_evidence": all_evidence_sentences[int(max_contradiction_idx)],
+                    "contradiction_score": max_contradiction_score,
                 }
                 logger.warning(f"Contradiction detected for claim: '{claim}'")
-                return DetectionResult(True, max_contradiction_score.item(), "contradiction", answer, evidence_docs, details)
-
-            claim_embedding = self.similarity_model.encode(claim, convert_to_tensor=True)
-            evidence_embeddings = self.similarity_model.encode(all_evidence_sentences, convert_to_tensor=True)
-
-            similarity_scores = util.pytorch_cos_sim(claim_embedding, evidence_embeddings)[0]
-            max_similarity_score = torch.max(similarity_scores).item()
+                return DetectionResult(True, max_contradiction_score, "contradiction", answer, evidence_docs, details)
 
             if max_similarity_score < self.similarity_threshold:
                 details = {
                     "problem_claim": claim,
                     "reason": "Low similarity to all evidence.",
                     "max_similarity_score": max_similarity_score,
-                    "closest_evidence": all_evidence_sentences[torch.argmax(similarity_scores).item()]
+                    "closest_evidence": all_evidence_sentences[int(closest_evidence_idx)]
                 }
                 logger.warning(f"Unsupported claim due to low similarity: '{claim}'")
                 return DetectionResult(True, 1 - max_similarity_score, "low_similarity", answer, evidence_docs, details)
@@ -141,3 +415,19 @@ class HallucinationDetector:
         details = {"reason": "All claims in the answer were successfully verified against the evidence."}
         logger.info("Answer verified. No hallucination detected.")
         return DetectionResult(False, 1.0, "verified", answer, evidence_docs, details)
+
+_detector_instance = None
+_detector_kwargs = None
+_detector_lock = threading.Lock()
+
+def get_detector(**kwargs) -> HallucinationDetector:
+    global _detector_instance, _detector_kwargs
+    if _detector_instance is None:
+        # Requests run on worker threads; only one of them should load the models.
+        with _detector_lock:
+            if _detector_instance is None:
+                _detector_instance = HallucinationDetector(**kwargs)
+                _detector_kwargs = kwargs
+    if kwargs != _detector_kwargs:
+        logger.warning(f"get_detector() ignoring {kwargs}; the shared detector was created with {_detector_kwargs}")
+    return _detector_instance
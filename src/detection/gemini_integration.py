@@ -1,7 +1,9 @@
 import os
+import asyncio
 import logging
+import random
 import time
-from typing import Optional
+from typing import List, Optional
 from dotenv import load_dotenv
 from langchain_google_genai import ChatGoogleGenerativeAI
 from google.api_core import exceptions
@@ -11,6 +13,10 @@ load_dotenv()
 logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(name)s - %(levelname)s - %(message)s')
 logger = logging.getLogger(__name__)
 
+BACKOFF_BASE_SECONDS = 1.0
+BACKOFF_CAP_SECONDS = 8.0
+RATE_LIMIT_COOLDOWN_SECONDS = 30.0
+
 class GeminiLLM:
     def __init__(self, api_key: Optional[str] = None, model_name: Optional[str] = None):
         logger.info("Initializing Gemini LLM via LangChain...")
@@ -18,6 +24,7 @@ class GeminiLLM:
         self.model_name = model_name or os.getenv("GEMINI_MODEL", "gemini-2.5-flash")
         self.model = None
         self.api_working = False
+        self._cooldown_until = 0.0
         self._initialize_llm()
 
     def _initialize_llm(self):
@@ -41,27 +48,71 @@ class GeminiLLM:
         self.api_working = False
         logger.warning(f"Switching to fallback mode. Reason: {reason}")
 
-    def generate_answer(self, question: str, max_retries: int = 3) -> str:
+    def _unavailable_reason(self) -> Optional[str]:
         if not self.api_working or not self.model:
             return "Error: Unable to access Gemini API. Please check your configuration and API key."
+        if time.monotonic() < self._cooldown_until:
+            return "Error: Gemini API is rate limited. Skipping request until the cooldown expires."
+        return None
+
+    def _retry_delay(self, attempt: int, max_retries: int) -> float:
+        # Full jitter keeps concurrent callers from retrying in lockstep.
+        wait_time = min(BACKOFF_CAP_SECONDS, BACKOFF_BASE_SECONDS * 2 ** attempt) * random.uniform(0.5, 1.5)
+        logger.warning(f"Rate limit exceeded. Retrying in {wait_time:.1f}s... (Attempt {attempt + 1}/{max_retries})")
+        return wait_time
+
+    def _failure_message(self, max_retries: int, last_exception: Optional[Exception]) -> str:
+        if isinstance(last_exception, exceptions.ResourceExhausted):
+            # Still throttled after every retry: stop sending requests for a while
+            # instead of having each caller run its own retry loop against the limit.
+            self._cooldown_until = time.monotonic() + RATE_LIMIT_COOLDOWN_SECONDS
+            logger.warning(f"Gemini still rate limited; pausing requests for {RATE_LIMIT_COOLDOWN_SECONDS:.0f}s.")
+        error_message = f"Error: Failed to generate answer from API after {max_retries} retries."
+        if last_exception:
+            error_message += f" Last error: {last_exception}"
+        return error_message
+
+    def generate_answer(self, question: str, max_retries: int = 3) -> str:
+        unavailable = self._unavailable_reason()
+        if unavailable:
+            return unavailable
         last_exception = None
         for attempt in range(max_retries):
             try:
                 response = self.model.invoke(question)
                 return response.content.strip()
             except exceptions.ResourceExhausted as e:
-                wait_time = (2 ** attempt)
-                logger.warning(f"Rate limit exceeded. Retrying in {wait_time}s... (Attempt {attempt + 1}/{max_retries})")
                 last_exception = e
-                time.sleep(wait_time)
+                if attempt + 1 < max_retries:
+                    time.sleep(self._retry_delay(attempt, max_retries))
             except Exception as e:
                 logger.error(f"An unexpected error occurred during content generation: {e}")
                 last_exception = e
                 break
-        error_message = f"Error: Failed to generate answer from API after {max_retries} retries."
-        if last_exception:
-            error_message += f" Last error: {last_exception}"
-        return error_message
+        return self._failure_message(max_retries, last_exception)
+
+    async def agenerate_answer(self, question: str, max_retries: int = 3) -> str:
+        unavailable = self._unavailable_reason()
+        if unavailable:
+            return unavailable
+        last_exception = None
+        for attempt in range(max_retries):
+            try:
+                response = await self.model.ainvoke(question)
+                return response.content.strip()
+            except exceptions.ResourceExhausted as e:
+                last_exception = e
+                if attempt + 1 < max_retries:
+                    await asyncio.sleep(self._retry_delay(attempt, max_retries))
+            except Exception as e:
+                logger.error(f"An unexpected error occurred during content generation: {e}")
+                last_exception = e
+                break
+        return self._failure_message(max_retries, last_exception)
+
+    async def abatch_generate(self, questions: List[str]) -> List[str]:
+        # All requests share this instance's client, so they reuse its open connections.
+        return await asyncio.gather(*(self.agenerate_answer(question) for question in questions))
 
 _gemini_llm_instance = None
 
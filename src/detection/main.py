@@ -1,13 +1,16 @@
 import os
 import sys
+import asyncio
 import logging
 from typing import List, Dict, Any
 from dotenv import load_dotenv
 
-sys.path.append(os.path.join(os.path.dirname(__file__), '..', '..'))
+ROOT_DIR = os.path.abspath(os.path.join(os.path.dirname(__file__), '..', '..'))
+if ROOT_DIR not in sys.path:
+    sys.path.insert(0, ROOT_DIR)
 
-from src.detection.detection_module import HallucinationDetector, DetectionResult
-from src.detection.gemini_integration import GeminiLLM
+from src.detection.detection_module import get_detector
+from src.detection.gemini_integration import get_gemini_llm
 
 logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(name)s - %(levelname)s - %(message)s')
 logger = logging.getLogger(__name__)
@@ -21,19 +24,40 @@ class HallucinationAnalysisPipeline:
     def _initialize_components(self):
         try:
             logger.info("Initializing Hallucination Analysis Pipeline...")
-            self.gemini_llm = GeminiLLM()
-            self.detector = HallucinationDetector()
+            self.gemini_llm = get_gemini_llm()
+            self.detector = get_detector()
             logger.info("Pipeline ready!")
         except Exception as e:
             logger.error(f"Error initializing pipeline: {e}")
             raise
     
-    def generate_and_detect(self, question: str, evidence_docs: List[str]) -> Dict[str, Any]:
+    def generate_answer(self, question: str) -> str:
         logger.info(f"\nProcessing question: {question}")
         logger.info("Generating answer with Gemini Pro...")
         raw_answer = self.gemini_llm.generate_answer(question)
         logger.info(f"Generated answer: {raw_answer}")
-        
+        return raw_answer
+
+    async def agenerate_answer(self, question: str) -> str:
+        logger.info(f"\nProcessing question: {question}")
+        logger.info("Generating answer with Gemini Pro...")
+        raw_answer = await self.gemini_llm.agenerate_answer(question)
+        logger.info(f"Generated answer: {raw_answer}")
+        return raw_answer
+
+    def generate_and_detect(self, question: str, evidence_docs: List[str]) -> Dict[str, Any]:
+        raw_answer = self.generate_answer(question)
+        return self.detect(question, raw_answer, evidence_docs)
+
+    async def agenerate_and_detect(self, question: str, evidence_docs: List[str]) -> Dict[str, Any]:
+        # Embed the evidence while the Gemini request is in flight instead of after it returns.
+        raw_answer, evidence_embeddings = await asyncio.gather(
+            self.agenerate_answer(question),
+            asyncio.to_thread(self.detector.encode_evidence, evidence_docs)
+        )
+        return await asyncio.to_thread(self.detect, question, raw_answer, evidence_docs, evidence_embeddings)
+
+    def detect(self, question: str, raw_answer: str, evidence_docs: List[str], evidence_embeddings=None) -> Dict[str, Any]:
         if raw_answer.startswith("Error:"):
             logger.error("Answer generation failed. Skipping hallucination detection.")
             return {
@@ -46,7 +70,7 @@ class HallucinationAnalysisPipeline:
             }
         
         logger.info("Detecting hallucinations...")
-        detection_result = self.detector.detect_hallucination(raw_answer, evidence_docs)
+        detection_result = self.detector.detect_hallucination(raw_answer, evidence_docs, evidence_embeddings)
         
         result = detection_result.to_dict()
         result['question'] = question
@@ -1,46 +1,55 @@
 import logging
+from itertools import islice
 from typing import List, Dict, Any, Optional
 from datasets import load_dataset
 import pandas as pd
+import pyarrow as pa
+import pyarrow.compute as pc
 
 logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
 
 class TruthfulQALoader:
-    def __init__(self, dataset_name: str = "truthful_qa", subset: str = "generation"):
+    def __init__(self, dataset_name: str = "truthful_qa", subset: str = "generation", streaming: bool = False):
         self.dataset_name = dataset_name
         self.subset = subset
+        # Streaming skips downloading and materializing the full split; rows are read on demand.
+        self.streaming = streaming
         self.dataset = None
         self._load_dataset()
     
     def _load_dataset(self):
         try:
             logger.info(f"Loading TruthfulQA dataset: {self.dataset_name}/{self.subset}")
-            self.dataset = load_dataset(self.dataset_name, self.subset)
+            self.dataset = load_dataset(self.dataset_name, self.subset, streaming=self.streaming)
             logger.info("Dataset loaded successfully")
         except Exception as e:
             logger.error(f"Error loading dataset: {e}")
             raise
     
+    def _head(self, split_name: str, num_samples: int):
+        split = self.dataset[split_name]
+        if self.streaming:
+            return list(islice(split, num_samples))
+        return split.select(range(min(num_samples, len(split))))
+
+    def _to_question_dicts(self, samples) -> List[Dict[str, Any]]:
+        # Decode Arrow rows in one batched call instead of row by row; streamed
+        # samples are already a list of dicts.
+        rows = samples if isinstance(samples, list) else samples.to_list()
+        return [{'id': i, 'question': row['question'], 'best_answer': row['best_answer'],
+                 'correct_answers': row['correct_answers'], 'incorrect_answers': row['incorrect_answers'],
+                 'category': row['category'], 'source': 'truthful_qa'}
+                for i, row in enumerate(rows)]
+
     def get_sample_questions(self, num_samples: int = 10) -> List[Dict[str, Any]]:
         if not self.dataset:
             logger.error("Dataset not loaded")
             return []
         try:
             split_name = 'validation' if 'validation' in self.dataset else 'train'
-            samples = self.dataset[split_name].select(range(min(num_samples, len(self.dataset[split_name]))))
-            sample_list = []
-            for i, sample in enumerate(samples):
-                sample_dict = {
-                    'id': i,
-                    'question': sample.get('question', ''),
-                    'best_answer': sample.get('best_answer', ''),
-                    'correct_answers': sample.get('correct_answers', []),
-                    'incorrect_answers': sample.get('incorrect_answers', []),
-                    'category': sample.get('category', ''),
-                    'source': 'truthful_qa'
-                }
-                sample_list.append(sample_dict)
+            samples = self._head(split_name, num_samples)
+            sample_list = self._to_question_dicts(samples)
             logger.info(f"Retrieved {len(sample_list)} sample questions")
             return sample_list
         except Exception as e:
@@ -54,20 +63,14 @@ class TruthfulQALoader:
         try:
             split_name = 'validation' if 'validation' in self.dataset else 'train'
             all_samples = self.dataset[split_name]
-            category_samples = [sample for sample in all_samples if sample.get('category', '') == category]
-            selected_samples = category_samples[:num_samples]
-            sample_list = []
-            for i, sample in enumerate(selected_samples):
-                sample_dict = {
-                    'id': i,
-                    'question': sample.get('question', ''),
-                    'best_answer': sample.get('best_answer', ''),
-                    'correct_answers': sample.get('correct_answers', []),
-                    'incorrect_answers': sample.get('incorrect_answers', []),
-                    'category': sample.get('category', ''),
-                    'source': 'truthful_qa'
-                }
-                sample_list.append(sample_dict)
+            if self.streaming:
+                category_samples = (sample for sample in all_samples if sample.get('category', '') == category)
+                selected_samples = list(islice(category_samples, num_samples))
+            else:
+                # Match on the Arrow column and only decode the rows that are returned.
+                matches = pc.indices_nonzero(pc.equal(all_samples.data.column('category'), category))
+                selected_samples = all_samples.select(matches[:num_samples].to_pylist())
+            sample_list = self._to_question_dicts(selected_samples)
             logger.info(f"Retrieved {len(sample_list)} questions from category: {category}")
             return sample_list
         except Exception as e:
@@ -81,12 +84,11 @@ class TruthfulQALoader:
         try:
             split_name = 'validation' if 'validation' in self.dataset else 'train'
             all_samples = self.dataset[split_name]
-            categories = set()
-            for sample in all_samples:
-                category = sample.get('category', '')
-                if category:
-                    categories.add(category)
-            category_list = sorted(list(categories))
+            if self.streaming:
+                categories = {sample.get('category', '') for sample in all_samples}
+            else:
+                categories = pc.unique(all_samples.data.column('category')).to_pylist()
+            category_list = sorted(category for category in categories if category)
             logger.info(f"Found {len(category_list)} categories: {category_list}")
             return category_list
         except Exception as e:
@@ -101,9 +103,13 @@ class TruthfulQALoader:
                 'dataset_name': self.dataset_name,
                 'subset': self.subset,
                 'splits': list(self.dataset.keys()),
-                'total_samples': sum(len(self.dataset[split]) for split in self.dataset.keys()),
                 'categories': self.get_all_categories()
             }
+            if self.streaming:
+                # Streamed splits have no length without reading them end to end.
+                info['total_samples'] = None
+                return info
+            info['total_samples'] = sum(len(self.dataset[split]) for split in self.dataset.keys())
             for split in self.dataset.keys():
                 info[f'{split}_samples'] = len(self.dataset[split])
             return info
@@ -117,8 +123,17 @@ class TruthfulQALoader:
             return False
         try:
             split_name = 'validation' if 'validation' in self.dataset else 'train'
-            samples = self.dataset[split_name].select(range(min(num_samples, len(self.dataset[split_name]))))
-            df = pd.DataFrame(samples)
+            samples = self._head(split_name, num_samples)
+            if self.streaming:
+                df = pd.DataFrame(samples)
+            else:
+                # Convert column-wise from Arrow rather than building a dict per row. List
+                # columns come back as numpy arrays; turn those back into lists so the CSV
+                # cells keep their "['a', 'b']" form.
+                df = samples.to_pandas()
+                for field in samples.data.schema:
+                    if pa.types.is_list(field.type) or pa.types.is_large_list(field.type):
+                        df[field.name] = df[field.name].map(lambda value: value if value is None else list(value))
             df.to_csv(filename, index=False)
             logger.info(f"Exported {len(df)} samples to {filename}")
             return True
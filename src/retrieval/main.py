@@ -4,7 +4,9 @@ import sys
 import os
 from typing import List
 
-sys.path.append(os.path.join(os.path.dirname(__file__), '..', '..'))
+ROOT_DIR = os.path.abspath(os.path.join(os.path.dirname(__file__), '..', '..'))
+if ROOT_DIR not in sys.path:
+    sys.path.insert(0, ROOT_DIR)
 
 from src.retrieval.retrieval_module import EvidenceRetriever, retrieve_evidence
 from src.retrieval.dataset_loader import TruthfulQALoader
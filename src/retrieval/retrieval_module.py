@@ -1,74 +1,168 @@
 import logging
-from typing import List
-from sentence_transformers import SentenceTransformer, util
-from nltk.tokenize import sent_tokenize
-import nltk
+import threading
+from collections import OrderedDict
+from functools import lru_cache
+from typing import List, Optional
+import numpy as np
+import torch
+from sentence_transformers import SentenceTransformer
+from rank_bm25 import BM25Okapi
 
-from .wikipedia_integration import WikipediaRetriever
+from src.utils.nlp import load_punkt_tokenizer
+from src.utils.torch_utils import fp16_autocast
+from .wikipedia_integration import WikipediaRetriever, extract_keywords, tokenize_words
 from .vector_database import VectorDatabase
 
 logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
 
-try:
-    nltk.data.find('tokenizers/punkt')
-except LookupError:
-    logger.info("NLTK 'punkt' resource not found. Downloading...")
-    nltk.download('punkt')
-
-try:
-    nltk.data.find('tokenizers/punkt_tab')
-except LookupError:
-    logger.info("NLTK 'punkt_tab' resource not found. Downloading...")
-    nltk.download('punkt_tab')
-
 class EvidenceRetriever:
     def __init__(self, 
                  embedding_model: str = "all-MiniLM-L6-v2",
                  max_evidence_docs: int = 5,
-                 similarity_threshold: float = 0.5):
+                 similarity_threshold: float = 0.5,
+                 question_cache_threshold: float = 0.95,
+                 question_cache_size: int = 1000,
+                 bm25_candidates: int = 64,
+                 use_onnx: bool = False,
+                 onnx_file_name: str = "onnx/model_qint8_avx512_vnni.onnx"):
         self.max_evidence_docs = max_evidence_docs
         self.similarity_threshold = similarity_threshold
+        # Only this many passages (best BM25 matches) go through the embedding model.
+        self.bm25_candidates = bm25_candidates
+        # Near-duplicate questions reuse earlier evidence. The threshold is kept high
+        # because questions that differ only in their subject ("capital of France" vs
+        # "capital of Spain") can still embed very close together.
+        self.question_cache_threshold = question_cache_threshold
+        self.question_cache_size = question_cache_size
+        # Each cached question owns a fixed row of _question_matrix; the OrderedDict maps
+        # it to that row and tracks recency, so hits never reorder or re-stack the matrix.
+        self._question_cache = OrderedDict()
+        self._question_entries = []
+        self._question_matrix = None
+        self._question_cache_lock = threading.Lock()
         self.wikipedia_retriever = WikipediaRetriever(max_results=max_evidence_docs)
-        self.vector_db = VectorDatabase()
+        # sent_tokenize re-resolves the punkt model on every call; load it once instead.
+        self._punkt = load_punkt_tokenizer()
+        # The INT8 ONNX graph targets the CPU execution provider.
+        self.use_onnx = use_onnx
+        self.onnx_file_name = onnx_file_name
+        self.device = "cuda" if torch.cuda.is_available() and not use_onnx else "cpu"
         self.embedding_model = None
         self._load_embedding_model(embedding_model)
+        self.vector_db = VectorDatabase(embedding_model=self.embedding_model)
+        # Repeated questions skip re-encoding the query.
+        self._encode_query = lru_cache(maxsize=256)(self._encode_query_uncached)
 
     def _load_embedding_model(self, model_name: str):
         try:
             logger.info(f"Loading embedding model: {model_name}")
-            self.embedding_model = SentenceTransformer(model_name)
+            if self.use_onnx:
+                self.embedding_model = self._load_onnx_embedding_model(model_name)
+            else:
+                self.embedding_model = SentenceTransformer(model_name, device=self.device)
+            if self.device == "cuda":
+                self.embedding_model.half()
             logger.info("Embedding model loaded successfully.")
         except Exception as e:
             logger.error(f"Error loading embedding model: {e}")
             raise
 
-    def _calculate_similarity(self, query: str, documents: List[str]) -> List[float]:
+    def _load_onnx_embedding_model(self, model_name: str) -> SentenceTransformer:
+        # The all-MiniLM-L6-v2 repo ships dynamically quantized INT8 graphs (onnx/model_qint8_*.onnx),
+        # so no export step is needed. Needs `optimum[onnxruntime]`.
+        try:
+            return SentenceTransformer(model_name, device=self.device, backend="onnx",
+                                       model_kwargs={"file_name": self.onnx_file_name,
+                                                     "provider": "CPUExecutionProvider"})
+        except Exception as e:
+            logger.warning(f"Could not load ONNX embedding model, falling back to PyTorch: {e}")
+            self.use_onnx = False
+            return SentenceTransformer(model_name, device=self.device)
+
+    def _encode(self, texts):
+        with torch.inference_mode(), fp16_autocast(self.device):
+            return self.embedding_model.encode(texts, convert_to_tensor=True, normalize_embeddings=True,
+                                               batch_size=64, show_progress_bar=False)
+
+    def _encode_query_uncached(self, query: str) -> torch.Tensor:
+        return self._encode(query)
+
+    def _calculate_similarity(self, query: str, documents: List[str]) -> torch.Tensor:
         if not documents or not self.embedding_model:
-            return []
+            return torch.empty(0)
         try:
-            query_embedding = self.embedding_model.encode(query, convert_to_tensor=True)
-            doc_embeddings = self.embedding_model.encode(documents, convert_to_tensor=True)
-            cosine_scores = util.cos_sim(query_embedding, doc_embeddings)
-            return cosine_scores.cpu().numpy().flatten().tolist()
+            query_embedding = self._encode_query(query)
+            doc_embeddings = self._encode(documents)
+            # Scores stay on the device; callers only pull back the few they select.
+            with torch.inference_mode():
+                return torch.matmul(doc_embeddings.float(), query_embedding.float())
         except Exception as e:
             logger.error(f"Error calculating similarities: {e}")
-            return [0.0] * len(documents)
+            return torch.zeros(len(documents))
 
     def _chunk_document_sliding_window(self, doc: str, sentences_per_chunk: int = 4, overlap: int = 1) -> List[str]:
-        sentences = sent_tokenize(doc)
+        sentences = self._punkt.tokenize(doc)
         if not sentences:
             return []
-        chunks = []
         step = sentences_per_chunk - overlap
-        for i in range(0, len(sentences), step):
-            chunk = sentences[i:i + sentences_per_chunk]
-            if chunk:
-                chunks.append(" ".join(chunk))
-        return chunks
+        return [" ".join(sentences[i:i + sentences_per_chunk]) for i in range(0, len(sentences), step)]
+
+    def _shortlist_passages(self, question: str, passages: List[str]) -> List[str]:
+        if len(passages) <= self.bm25_candidates:
+            return passages
+        query_tokens = [keyword.lower() for keyword in extract_keywords(question)]
+        if not query_tokens:
+            return passages
+        bm25 = BM25Okapi([tokenize_words(passage) for passage in passages])
+        scores = bm25.get_scores(query_tokens)
+        if not scores.any():
+            return passages
+        top_idxs = np.argpartition(-scores, self.bm25_candidates - 1)[:self.bm25_candidates]
+        # Keep document order so the shortlist doesn't depend on partition order.
+        return [passages[i] for i in np.sort(top_idxs)]
+
+    def _get_cached_evidence(self, question: str) -> Optional[List[str]]:
+        query_embedding = self._encode_query(question).float()
+        with self._question_cache_lock:
+            if not self._question_cache:
+                return None
+            similarities = torch.matmul(self._question_matrix[:len(self._question_entries)], query_embedding)
+            best_score, best_idx = torch.max(similarities, dim=0)
+            if best_score.item() < self.question_cache_threshold:
+                return None
+            cached_question, evidence = self._question_entries[best_idx.item()]
+            self._question_cache.move_to_end(cached_question)
+            return list(evidence)
+
+    def _cache_evidence(self, question: str, evidence: List[str]):
+        if self.question_cache_size <= 0:
+            return
+        query_embedding = self._encode_query(question).float()
+        with self._question_cache_lock:
+            if self._question_matrix is None:
+                self._question_matrix = query_embedding.new_empty((self.question_cache_size, query_embedding.shape[0]))
+            if question in self._question_cache:
+                row = self._question_cache[question]
+                self._question_cache.move_to_end(question)
+            elif len(self._question_cache) >= self.question_cache_size:
+                # Evict the least recently used question and reuse its row.
+                _, row = self._question_cache.popitem(last=False)
+                self._question_cache[question] = row
+            else:
+                row = len(self._question_entries)
+                self._question_entries.append(None)
+                self._question_cache[question] = row
+            self._question_matrix[row] = query_embedding
+            self._question_entries[row] = (question, list(evidence))
 
     def retrieve_evidence(self, question: str, use_cached: bool = True) -> List[str]:
         logger.info(f"Starting evidence retrieval for question: {question}")
+        if use_cached:
+            cached_evidence = self._get_cached_evidence(question)
+            if cached_evidence is not None:
+                logger.info("Returning cached evidence from a semantically similar question.")
+                return cached_evidence
         all_docs = {}
         try:
             wikipedia_docs = self.wikipedia_retriever.retrieve_evidence_documents(question)
@@ -76,30 +170,41 @@ class EvidenceRetriever:
                 all_docs[doc] = "fresh"
         except Exception as e:
             logger.error(f"Error retrieving from Wikipedia: {e}")
-        if use_cached:
-            pass
         unique_docs = list(all_docs.keys())
         if not unique_docs:
             return []
-        all_passages = []
+        all_passages = {}
         for doc in unique_docs:
-            passages = self._chunk_document_sliding_window(doc)
-            all_passages.extend(passages)
+            for passage in self._chunk_document_sliding_window(doc):
+                all_passages[passage] = None
         if not all_passages:
             logger.warning("Could not extract any valid passages from the retrieved documents.")
             return []
+        all_passages = self._shortlist_passages(question, list(all_passages))
         logger.info(f"Extracted {len(all_passages)} passages for reranking.")
         similarities = self._calculate_similarity(question, all_passages)
-        passage_sim_pairs = list(zip(all_passages, similarities))
-        relevant_pairs = [(p, s) for p, s in passage_sim_pairs if s >= self.similarity_threshold]
-        if not relevant_pairs:
+        # Only the best few passages are kept, so select them with topk instead of
+        # sorting every passage; the threshold then only needs checking on those.
+        top_scores, top_idxs = torch.topk(similarities, k=min(self.max_evidence_docs, similarities.numel()))
+        final_evidence = [all_passages[i] for i in top_idxs[top_scores >= self.similarity_threshold].tolist()]
+        if not final_evidence:
             logger.warning(f"No passages met the similarity threshold of {self.similarity_threshold}")
             return []
-        relevant_pairs.sort(key=lambda x: x[1], reverse=True)
-        final_evidence = [p for p, _ in relevant_pairs[:self.max_evidence_docs]]
         logger.info(f"Retrieved {len(final_evidence)} final evidence passages after reranking.")
+        self._cache_evidence(question, final_evidence)
         return final_evidence
 
+_retriever_instance = None
+_retriever_lock = threading.Lock()
+
+def get_evidence_retriever() -> EvidenceRetriever:
+    global _retriever_instance
+    if _retriever_instance is None:
+        with _retriever_lock:
+            if _retriever_instance is None:
+                _retriever_instance = EvidenceRetriever(max_evidence_docs=3, similarity_threshold=0.5)
+    return _retriever_instance
+
 def retrieve_evidence(question: str):
-    retriever = EvidenceRetriever(max_evidence_docs=3, similarity_threshold=0.5)
+    retriever = get_evidence_retriever()
     return retriever.retrieve_evidence(question)
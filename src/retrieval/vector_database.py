@@ -1,108 +1,218 @@
-import chromadb
-from chromadb.config import Settings
+import faiss
 import logging
 from typing import List, Dict, Any, Optional
 import hashlib
+import json
 import os
+import sqlite3
+import threading
+from dataclasses import dataclass
+import numpy as np
+from sentence_transformers import SentenceTransformer
 
 logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
 
+DEFAULT_EMBEDDING_MODEL = "all-MiniLM-L6-v2"
+HNSW_M = 32
+HNSW_EF_SEARCH = 64
+RERANK_FACTOR = 4
+# The 8-bit quantizer learns a per-dimension range from stored vectors, so small stores
+# use an exact index until there are enough vectors to calibrate it.
+QUANTIZER_MIN_TRAINING_VECTORS = 1000
+# Widens each learned range by this fraction so later vectors are rarely clipped.
+QUANTIZER_RANGE_MARGIN = 0.1
+SQLITE_MAX_PARAMS = 500
+
+@dataclass(slots=True, frozen=True)
+class Hit:
+    document: str
+    # Cosine distance, so lower still means closer.
+    distance: float
+    metadata: Dict[str, Any]
+    id: str
+
 class VectorDatabase:
-    def __init__(self, collection_name: str = "evidence_documents", persist_directory: str = "./chroma_db"):
+    def __init__(self, collection_name: str = "evidence_documents", persist_directory: str = "./vector_db",
+                 embedding_model=None):
         self.collection_name = collection_name
         self.persist_directory = persist_directory
         os.makedirs(persist_directory, exist_ok=True)
-        self.client = chromadb.PersistentClient(
-            path=persist_directory,
-            settings=Settings(
-                anonymized_telemetry=False,
-                allow_reset=True
-            )
-        )
-        try:
-            self.collection = self.client.get_collection(name=collection_name)
-            logger.info(f"Loaded existing collection: {collection_name}")
-        except Exception:
-            self.collection = self.client.create_collection(
-                name=collection_name,
-                metadata={"description": "Evidence documents for hallucination detection"}
+        self.embedding_model = embedding_model if embedding_model is not None else SentenceTransformer(DEFAULT_EMBEDDING_MODEL)
+        self.dimension = self.embedding_model.get_sentence_embedding_dimension()
+        self.index_path = os.path.join(persist_directory, f"{collection_name}.faiss")
+        self._lock = threading.Lock()
+        # Text, metadata and the full-precision vectors live in SQLite. The FAISS index only
+        # holds (int8) codes keyed by row id, so it can always be rebuilt from the table (HNSW has no delete).
+        self.conn = sqlite3.connect(os.path.join(persist_directory, f"{collection_name}.sqlite3"), check_same_thread=False)
+        self.conn.execute("""
+            CREATE TABLE IF NOT EXISTS documents (
+                id INTEGER PRIMARY KEY,
+                doc_id TEXT UNIQUE NOT NULL,
+                document TEXT NOT NULL,
+                metadata TEXT NOT NULL,
+                embedding BLOB NOT NULL
             )
-            logger.info(f"Created new collection: {collection_name}")
-    
+        """)
+        self.conn.commit()
+        self.index = self._load_index()
+        logger.info(f"Opened collection: {collection_name} ({self.index.ntotal} documents)")
+
+    def _new_index(self, training_vectors: Optional[np.ndarray] = None):
+        # Embeddings are unit-length, so inner product is cosine similarity.
+        if training_vectors is None or len(training_vectors) < QUANTIZER_MIN_TRAINING_VECTORS:
+            index = faiss.IndexHNSWFlat(self.dimension, HNSW_M, faiss.METRIC_INNER_PRODUCT)
+        else:
+            index = faiss.IndexHNSWSQ(self.dimension, faiss.ScalarQuantizer.QT_8bit, HNSW_M, faiss.METRIC_INNER_PRODUCT)
+            faiss.downcast_index(index.storage).sq.rangestat_arg = QUANTIZER_RANGE_MARGIN
+            index.train(training_vectors)
+        index.hnsw.efSearch = HNSW_EF_SEARCH
+        return faiss.IndexIDMap(index)
+
+    @staticmethod
+    def _is_quantized(index) -> bool:
+        return isinstance(faiss.downcast_index(index.index), faiss.IndexHNSWSQ)
+
+    def _load_index(self):
+        count = self.conn.execute("SELECT COUNT(*) FROM documents").fetchone()[0]
+        if os.path.exists(self.index_path):
+            try:
+                index = faiss.read_index(self.index_path)
+                if index.ntotal == count and index.d == self.dimension and (
+                        self._is_quantized(index) or count < QUANTIZER_MIN_TRAINING_VECTORS):
+                    return index
+                logger.warning("FAISS index is out of sync with the document store. Rebuilding.")
+            except Exception as e:
+                logger.warning(f"Could not read FAISS index, rebuilding: {e}")
+        return self._rebuild_index()
+
+    def _rebuild_index(self):
+        # Rebuilding also recalibrates the quantizer on everything currently stored.
+        rows = self.conn.execute("SELECT id, embedding FROM documents").fetchall()
+        if not rows:
+            index = self._new_index()
+        else:
+            ids = np.array([row_id for row_id, _ in rows], dtype=np.int64)
+            vectors = np.stack([np.frombuffer(embedding, dtype=np.float32) for _, embedding in rows])
+            index = self._new_index(vectors)
+            index.add_with_ids(vectors, ids)
+        faiss.write_index(index, self.index_path)
+        return index
+
+    def _embed(self, texts: List[str]) -> np.ndarray:
+        embeddings = self.embedding_model.encode(texts, normalize_embeddings=True, batch_size=64, show_progress_bar=False)
+        return np.ascontiguousarray(embeddings, dtype=np.float32)
+
+    def _select_in(self, columns: str, key: str, values: list) -> list:
+        rows = []
+        for start in range(0, len(values), SQLITE_MAX_PARAMS):
+            chunk = values[start:start + SQLITE_MAX_PARAMS]
+            placeholders = ",".join("?" * len(chunk))
+            rows.extend(self.conn.execute(f"SELECT {columns} FROM documents WHERE {key} IN ({placeholders})", chunk))
+        return rows
+
     def add_documents(self, documents: List[str], metadatas: Optional[List[Dict[str, Any]]] = None) -> List[str]:
         if not documents:
             logger.warning("No documents provided to add")
             return []
-        
-        doc_ids = [hashlib.md5(doc.encode()).hexdigest() for doc in documents]
-        
+
+        doc_ids = [hashlib.blake2b(doc.encode("utf-8", "ignore"), digest_size=16).hexdigest() for doc in documents]
+
         if metadatas is None:
             metadatas = [{"source": "unknown"} for _ in documents]
-        
+
         try:
-            logger.info(f"Upserting {len(documents)} documents to vector database")
-            self.collection.upsert(
-                documents=documents,
-                metadatas=metadatas,
-                ids=doc_ids
-            )
-            logger.info("Documents upserted successfully")
+            with self._lock:
+                # IDs are content hashes, so an ID that is already stored holds the same text;
+                # only embed and insert documents the store hasn't seen.
+                existing_ids = {doc_id for (doc_id,) in self._select_in("doc_id", "doc_id", list(set(doc_ids)))}
+                new_entries = {}
+                for doc_id, doc, metadata in zip(doc_ids, documents, metadatas):
+                    if doc_id not in existing_ids:
+                        new_entries.setdefault(doc_id, (doc, metadata))
+                if not new_entries:
+                    logger.info("All documents already present in vector database")
+                    return doc_ids
+
+                logger.info(f"Adding {len(new_entries)} new documents to vector database ({len(documents) - len(new_entries)} already stored)")
+                embeddings = self._embed([doc for doc, _ in new_entries.values()])
+                row_ids = []
+                with self.conn:
+                    for (doc_id, (doc, metadata)), embedding in zip(new_entries.items(), embeddings):
+                        cursor = self.conn.execute(
+                            "INSERT INTO documents (doc_id, document, metadata, embedding) VALUES (?, ?, ?, ?)",
+                            (doc_id, doc, json.dumps(metadata), embedding.tobytes())
+                        )
+                        row_ids.append(cursor.lastrowid)
+                if not self._is_quantized(self.index) and self.index.ntotal + len(row_ids) >= QUANTIZER_MIN_TRAINING_VECTORS:
+                    logger.info("Enough documents stored to calibrate the 8-bit quantizer. Rebuilding index.")
+                    self.index = self._rebuild_index()
+                else:
+                    self.index.add_with_ids(embeddings, np.array(row_ids, dtype=np.int64))
+                    faiss.write_index(self.index, self.index_path)
+            logger.info("Documents added successfully")
             return doc_ids
         except Exception as e:
-            logger.error(f"Error upserting documents: {e}")
+            logger.error(f"Error adding documents: {e}")
             return []
-    
-    def search_similar(self, query: str, n_results: int = 5) -> List[Dict[str, Any]]:
+
+    def search_similar(self, query: str, n_results: int = 5,
+                       query_embedding: Optional[np.ndarray] = None) -> List[Hit]:
         try:
-            count = self.collection.count()
+            count = self.index.ntotal
             if count == 0:
                 logger.warning("Search attempted on an empty collection.")
                 return []
-            
+
             effective_n_results = min(n_results, count)
 
             logger.info(f"Searching for {effective_n_results} similar documents to: {query[:100]}...")
-            results = self.collection.query(
-                query_texts=[query],
-                n_results=effective_n_results
-            )
-            
-            formatted_results = []
-            if results['documents'] and results['documents'][0]:
-                for i, doc in enumerate(results['documents'][0]):
-                    result = {
-                        'document': doc,
-                        'distance': results['distances'][0][i] if results['distances'] else 0.0,
-                        'metadata': results['metadatas'][0][i] if results['metadatas'] else {},
-                        'id': results['ids'][0][i] if results['ids'] else None
-                    }
-                    formatted_results.append(result)
-            
+            if query_embedding is None:
+                query_embedding = self._embed([query])[0]
+            query_vector = np.ascontiguousarray(query_embedding, dtype=np.float32).reshape(1, -1)
+            with self._lock:
+                # Once quantized, the index scores int8 codes, so over-fetch and rerank the
+                # candidates exactly against their stored FP32 vectors.
+                _, row_ids = self.index.search(query_vector, min(effective_n_results * RERANK_FACTOR, count))
+                candidate_ids = [int(row_id) for row_id in row_ids[0] if row_id != -1]
+                rows = self._select_in("id, doc_id, document, metadata, embedding", "id", candidate_ids)
+
+            if not rows:
+                return []
+            vectors = np.stack([np.frombuffer(row[4], dtype=np.float32) for row in rows])
+            scores = vectors @ query_vector[0]
+            top = np.argsort(-scores)[:effective_n_results]
+
+            formatted_results = [
+                Hit(doc, distance, json.loads(metadata), doc_id)
+                for (_, doc_id, doc, metadata, _), distance in zip((rows[i] for i in top), (1.0 - scores[top]).tolist())
+            ]
+
             logger.info(f"Found {len(formatted_results)} similar documents")
             return formatted_results
-            
+
         except Exception as e:
             logger.error(f"Error searching similar documents: {e}")
             return []
-    
+
     def get_document_by_id(self, doc_id: str) -> Optional[Dict[str, Any]]:
         try:
-            results = self.collection.get(ids=[doc_id])
-            if results['documents'] and results['documents'][0]:
+            with self._lock:
+                row = self.conn.execute("SELECT document, metadata FROM documents WHERE doc_id = ?", (doc_id,)).fetchone()
+            if row:
                 return {
-                    'document': results['documents'][0],
-                    'metadata': results['metadatas'][0] if results['metadatas'] else {},
+                    'document': row[0],
+                    'metadata': json.loads(row[1]),
                     'id': doc_id
                 }
             return None
         except Exception as e:
             logger.error(f"Error getting document by ID: {e}")
             return None
-    
+
     def get_collection_stats(self) -> Dict[str, Any]:
         try:
-            count = self.collection.count()
+            count = self.index.ntotal
             return {
                 'total_documents': count,
                 'collection_name': self.collection_name,
@@ -111,31 +221,38 @@ class VectorDatabase:
         except Exception as e:
             logger.error(f"Error getting collection stats: {e}")
             return {}
-    
+
     def clear_collection(self) -> bool:
         try:
-            self.client.delete_collection(name=self.collection_name)
-            self.collection = self.client.create_collection(
-                name=self.collection_name,
-                metadata={"description": "Evidence documents for hallucination detection"}
-            )
+            with self._lock:
+                with self.conn:
+                    self.conn.execute("DELETE FROM documents")
+                self.index = self._rebuild_index()
             logger.info("Collection cleared successfully")
             return True
         except Exception as e:
             logger.error(f"Error clearing collection: {e}")
             return False
-    
+
     def update_document(self, doc_id: str, document: str, metadata: Optional[Dict[str, Any]] = None) -> bool:
         try:
-            update_data = {
-                'ids': [doc_id],
-                'documents': [document]
-            }
-            
-            if metadata:
-                update_data['metadatas'] = [metadata]
-            
-            self.collection.update(**update_data)
+            embedding = self._embed([document])[0]
+            with self._lock:
+                with self.conn:
+                    if metadata:
+                        cursor = self.conn.execute(
+                            "UPDATE documents SET document = ?, metadata = ?, embedding = ? WHERE doc_id = ?",
+                            (document, json.dumps(metadata), embedding.tobytes(), doc_id)
+                        )
+                    else:
+                        cursor = self.conn.execute(
+                            "UPDATE documents SET document = ?, embedding = ? WHERE doc_id = ?",
+                            (document, embedding.tobytes(), doc_id)
+                        )
+                if cursor.rowcount == 0:
+                    logger.error(f"Error updating document: {doc_id} not found")
+                    return False
+                self.index = self._rebuild_index()
             logger.info(f"Updated document: {doc_id}")
             return True
         except Exception as e:
@@ -1,82 +1,212 @@
-import wikipedia
+import asyncio
+import atexit
 import re
 import logging
-import warnings
-from bs4 import GuessedAtParserWarning
+import threading
+import weakref
+import aiohttp
+import diskcache
 from typing import List, Optional
 from collections import OrderedDict
 
-warnings.filterwarnings("ignore", category=GuessedAtParserWarning)
-
 logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
 
+WIKIPEDIA_API_URL = "https://en.wikipedia.org/w/api.php"
+USER_AGENT = "HallucinationDetectionAndCorrection/1.0 (evidence retrieval)"
+CACHE_EXPIRE_SECONDS = 7 * 24 * 3600
+
+_loop = None
+_loop_lock = threading.Lock()
+_open_sessions = weakref.WeakSet()
+
+def _run_coroutine(coro):
+    # Callers may already be inside an event loop (async code, or gevent greenlets that
+    # share the request's OS thread), where asyncio.run refuses to start. All HTTP work
+    # runs on one background loop instead and callers block on the result.
+    global _loop
+    if _loop is None:
+        with _loop_lock:
+            if _loop is None:
+                loop = asyncio.new_event_loop()
+                threading.Thread(target=loop.run_forever, name="wikipedia-aiohttp", daemon=True).start()
+                _loop = loop
+    return asyncio.run_coroutine_threadsafe(coro, _loop).result()
+
+async def _close_all_sessions():
+    await asyncio.gather(*(session.close() for session in list(_open_sessions)), return_exceptions=True)
+
+def _discard_session(session):
+    # Runs when a retriever is garbage-collected, possibly on the loop thread itself,
+    # so only schedule the close rather than waiting for it.
+    if _loop is not None and not _loop.is_closed() and not session.closed:
+        asyncio.run_coroutine_threadsafe(session.close(), _loop)
+
+@atexit.register
+def _close_sessions():
+    if _loop is not None and _open_sessions:
+        asyncio.run_coroutine_threadsafe(_close_all_sessions(), _loop).result(timeout=5)
+
+_PROPER_NOUN_PATTERN = re.compile(r'\b[A-Z][a-z]+\b')
+_WORD_PATTERN = re.compile(r'\b\w+\b')
+
+STOP_WORDS = frozenset({
+    'a','about','above','after','again','against','all','am','an','and','any','are','as','at',
+    'be','because','been','before','being','below','between','both','but','by','can','did','do',
+    'does','doing','down','during','each','few','for','from','further','had','has','have','having',
+    'he','her','here','hers','herself','him','himself','his','how','i','if','in','into','is','it',
+    'its','itself','just','me','more','most','my','myself','no','nor','not','now','of','off','on',
+    'once','only','or','other','our','ours','ourselves','out','over','own','s','same','she','should',
+    'so','some','such','t','than','that','the','their','theirs','them','themselves','then','there',
+    'these','they','this','those','through','to','too','under','until','up','very','was','we','were',
+    'what','when','where','which','while','who','whom','why','will','with','you','your','yours',
+    'yourself','yourselves','known'
+})
+
+def tokenize_words(text: str) -> List[str]:
+    return _WORD_PATTERN.findall(text.lower())
+
+def extract_keywords(question: str) -> List[str]:
+    proper_nouns = _PROPER_NOUN_PATTERN.findall(question)
+    proper_lower = {p.lower() for p in proper_nouns}
+    other_words = [word for word in tokenize_words(question)
+                   if word not in STOP_WORDS and word not in proper_lower]
+    keywords = proper_nouns + other_words
+    return list(OrderedDict.fromkeys(keywords))[:5]
+
 class WikipediaRetriever:
-    def __init__(self, max_chars: int = 2000, max_results: int = 5):
+    def __init__(self, max_chars: int = 2000, max_results: int = 5, max_workers: int = 8,
+                 timeout: float = 10.0, cache_dir: Optional[str] = "./wiki_cache"):
         self.max_chars = max_chars
         self.max_results = max_results
+        self.max_workers = max_workers
+        self.timeout = timeout
+        # Search results and page text are cached on disk for a week; pass cache_dir=None to disable.
+        self._cache = diskcache.Cache(cache_dir) if cache_dir else None
+        self._http_session = None
 
-    def retrieve_evidence_documents(self, question: str) -> List[str]:
-        logger.info(f"Starting evidence retrieval for question: {question}")
-        
+    def _cache_get(self, key: tuple):
+        return self._cache.get(key) if self._cache is not None else None
+
+    def _cache_set(self, key: tuple, value):
+        if self._cache is not None:
+            self._cache.set(key, value, expire=CACHE_EXPIRE_SECONDS)
+
+    async def _get_session(self) -> aiohttp.ClientSession:
+        # Only ever called on the background loop, so there is no race between the check
+        # and the assignment. The session's keep-alive pool is reused across retrievals.
+        if self._http_session is None or self._http_session.closed:
+            self._http_session = aiohttp.ClientSession(
+                connector=aiohttp.TCPConnector(limit=self.max_workers),
+                timeout=aiohttp.ClientTimeout(total=self.timeout),
+                headers={"User-Agent": USER_AGENT},
+            )
+            _open_sessions.add(self._http_session)
+            # Sessions still open at exit are closed by _close_sessions instead.
+            weakref.finalize(self, _discard_session, self._http_session).atexit = False
+        return self._http_session
+
+    async def _query(self, session: aiohttp.ClientSession, **params) -> dict:
+        params.update(action="query", format="json", formatversion="2")
+        async with session.get(WIKIPEDIA_API_URL, params=params) as response:
+            response.raise_for_status()
+            return await response.json()
+
+    async def _search(self, session: aiohttp.ClientSession, query: str) -> List[str]:
+        cache_key = ("search", query, self.max_results)
+        cached = self._cache_get(cache_key)
+        if cached is not None:
+            return cached
+        try:
+            data = await self._query(session, list="search", srsearch=query, srlimit=self.max_results, srprop="")
+            titles = [result["title"] for result in data.get("query", {}).get("search", [])]
+            self._cache_set(cache_key, titles)
+            return titles
+        except Exception as e:
+            logger.warning(f"Wikipedia search failed for query '{query}': {e}")
+            return []
+
+    async def _fetch_page(self, session: aiohttp.ClientSession, title: str, sentences: Optional[int] = None) -> Optional[dict]:
+        # Plain-text extracts come back without any HTML to parse. Full-page extracts are
+        # limited to one title per request, so pages are fetched concurrently instead.
+        params = {"prop": "extracts|pageprops", "ppprop": "disambiguation", "explaintext": "1",
+                  "redirects": "1", "titles": title}
+        if sentences:
+            params.update(exintro="1", exsentences=str(sentences))
+        cache_key = ("page", title, sentences)
+        cached = self._cache_get(cache_key)
+        if cached is not None:
+            # Missing and disambiguation pages are cached as {} so they aren't re-requested.
+            return cached or None
+        try:
+            data = await self._query(session, **params)
+        except Exception as page_e:
+            logger.warning(f"Could not retrieve content for page '{title}': {page_e}")
+            return None
+        pages = data.get("query", {}).get("pages", [])
+        if not pages or pages[0].get("missing") or pages[0].get("invalid"):
+            logger.warning(f"Could not find Wikipedia page for '{title}'. Skipping.")
+            self._cache_set(cache_key, {})
+            return None
+        page = pages[0]
+        if "disambiguation" in page.get("pageprops", {}):
+            logger.warning(f"Disambiguation page for '{title}'. Skipping.")
+            self._cache_set(cache_key, {})
+            return None
+        self._cache_set(cache_key, page)
+        return page
+
+    def _truncate(self, text: str) -> str:
+        # Keep the lead of the article, cut back to a word boundary so chunking
+        # doesn't end on half a word.
+        if not self.max_chars or len(text) <= self.max_chars:
+            return text
+        cut = text[:self.max_chars]
+        boundary = cut.rfind(" ")
+        return cut[:boundary] if boundary > 0 else cut
+
+    async def _retrieve(self, search_queries: List[str]) -> List[str]:
         documents = []
         seen_titles = set()
+        session = await self._get_session()
+        search_results = await asyncio.gather(*(self._search(session, query) for query in search_queries))
+        unique_candidate_titles = list(OrderedDict.fromkeys(title for results in search_results for title in results))
+
+        logger.info(f"Fetching content for top {len(unique_candidate_titles)} candidate titles...")
+        tasks = [asyncio.create_task(self._fetch_page(session, title)) for title in unique_candidate_titles]
+        try:
+            # Consume pages in search-rank order so the same documents win as with sequential fetching.
+            for task in tasks:
+                if len(documents) >= self.max_results:
+                    break
+                page = await task
+                if page is None or page["title"] in seen_titles or not page.get("extract"):
+                    continue
+                documents.append(self._truncate(page["extract"]))
+                seen_titles.add(page["title"])
+                logger.info(f"Added evidence document from search result: {page['title']}")
+        finally:
+            # Once max_results documents are in, the remaining fetches aren't needed.
+            pending = [task for task in tasks if not task.done()]
+            for task in pending:
+                task.cancel()
+            await asyncio.gather(*pending, return_exceptions=True)
+        return documents
+
+    def retrieve_evidence_documents(self, question: str) -> List[str]:
+        logger.info(f"Starting evidence retrieval for question: {question}")
 
         keywords = self._extract_keywords(question)
         search_queries = self._generate_search_queries(question, keywords)
         logger.info(f"Generated search queries: {search_queries}")
 
-        candidate_titles = []
-        for query in search_queries:
-            try:
-                results = wikipedia.search(query, results=self.max_results)
-                candidate_titles.extend(results)
-            except Exception as e:
-                logger.warning(f"Wikipedia search failed for query '{query}': {e}")
-        
-        unique_candidate_titles = list(OrderedDict.fromkeys(candidate_titles))
-        
-        logger.info(f"Fetching content for top {len(unique_candidate_titles)} candidate titles...")
-        for title in unique_candidate_titles:
-            if len(documents) >= self.max_results:
-                break
-            
-            if title not in seen_titles:
-                try:
-                    page = wikipedia.page(title, auto_suggest=False, redirect=True)
-                    content = page.content
-                    documents.append(content)
-                    seen_titles.add(page.title)
-                    logger.info(f"Added evidence document from search result: {page.title}")
-                except wikipedia.exceptions.PageError:
-                    logger.warning(f"Could not find Wikipedia page for '{title}'. Skipping.")
-                except wikipedia.exceptions.DisambiguationError as e:
-                    logger.warning(f"Disambiguation page for '{title}'. Skipping. Options: {e.options[:3]}")
-                except Exception as page_e:
-                    logger.warning(f"Could not retrieve content for page '{title}': {page_e}")
+        documents = _run_coroutine(self._retrieve(search_queries))
 
         logger.info(f"Retrieved {len(documents)} unique evidence documents from Wikipedia.")
         return documents
 
     def _extract_keywords(self, question: str) -> List[str]:
-        stop_words = {
-            'a','about','above','after','again','against','all','am','an','and','any','are','as','at',
-            'be','because','been','before','being','below','between','both','but','by','can','did','do',
-            'does','doing','down','during','each','few','for','from','further','had','has','have','having',
-            'he','her','here','hers','herself','him','himself','his','how','i','if','in','into','is','it',
-            'its','itself','just','me','more','most','my','myself','no','nor','not','now','of','off','on',
-            'once','only','or','other','our','ours','ourselves','out','over','own','s','same','she','should',
-            'so','some','such','t','than','that','the','their','theirs','them','themselves','then','there',
-            'these','they','this','those','through','to','too','under','until','up','very','was','we','were',
-            'what','when','where','which','while','who','whom','why','will','with','you','your','yours',
-            'yourself','yourselves','known'
-        }
-        
-        proper_nouns = [word for word in re.findall(r'\b[A-Z][a-z]+\b', question)]
-        words = re.findall(r'\b\w+\b', question.lower())
-        other_words = [word for word in words if word not in stop_words and word not in [p.lower() for p in proper_nouns]]
-        keywords = proper_nouns + other_words
-        return list(OrderedDict.fromkeys(keywords))[:5]
+        return extract_keywords(question)
 
     def _generate_search_queries(self, question: str, keywords: List[str]) -> List[str]:
         search_queries = []
@@ -86,9 +216,14 @@ class WikipediaRetriever:
         search_queries.extend(keywords)
         return list(OrderedDict.fromkeys(search_queries))
 
+    async def _summary(self, page_title: str) -> Optional[str]:
+        session = await self._get_session()
+        page = await self._fetch_page(session, page_title, sentences=3)
+        return page.get("extract") if page else None
+
     def get_page_summary(self, page_title: str) -> Optional[str]:
         try:
-            return wikipedia.summary(page_title, sentences=3, auto_suggest=False, redirect=True)
+            return _run_coroutine(self._summary(page_title))
         except Exception as e:
             logger.error(f"Error getting summary for {page_title}: {e}")
             return None
@@ -0,0 +1,24 @@
+import logging
+import nltk
+
+logger = logging.getLogger(__name__)
+
+try:
+    nltk.data.find('tokenizers/punkt')
+except LookupError:
+    logger.info("NLTK 'punkt' resource not found. Downloading...")
+    nltk.download('punkt')
+
+try:
+    nltk.data.find('tokenizers/punkt_tab')
+except LookupError:
+    logger.info("NLTK 'punkt_tab' resource not found. Downloading...")
+    nltk.download('punkt_tab')
+
+def load_punkt_tokenizer():
+    try:
+        from nltk.tokenize import PunktTokenizer
+    except ImportError:
+        # NLTK < 3.9 ships the pickled model instead of punkt_tab.
+        return nltk.data.load('tokenizers/punkt/english.pickle')
+    return PunktTokenizer()
@@ -0,0 +1,8 @@
+import contextlib
+import torch
+
+def fp16_autocast(device):
+    # Mixed precision only pays off on CUDA; elsewhere run in the model's own dtype.
+    if torch.device(device).type == "cuda":
+        return torch.autocast(device_type="cuda", dtype=torch.float16)
+    return contextlib.nullcontext()
@@ -0,0 +1,74 @@
+import importlib
+import os
+import sys
+
+import pytest
+
+try:
+    import src.detection.main as detection_main
+except LookupError:
+    # The detection module loads NLTK punkt at import time.
+    pytest.skip("NLTK punkt data is not installed", allow_module_level=True)
+import src.retrieval.retrieval_module as retrieval_module
+from src.retrieval.wikipedia_integration import WikipediaRetriever
+
+FRONTEND_DIR = os.path.abspath(os.path.join(os.path.dirname(__file__), "..", "Frontend Code"))
+EVIDENCE = "Paris is the capital and largest city of France."
+
+
+class FakeDetector:
+    def encode_evidence(self, evidence_docs):
+        return None
+
+
+class FakePipeline:
+    def __init__(self):
+        self.detector = FakeDetector()
+        self.detected_evidence = []
+
+    def generate_answer(self, question):
+        return "Paris is the capital of France."
+
+    def detect(self, question, raw_answer, evidence_docs, evidence_embeddings=None):
+        self.detected_evidence.append(evidence_docs)
+        return {"raw_answer": raw_answer, "is_hallucination": not evidence_docs, "confidence_score": 0.9}
+
+
+class StubEvidenceRetriever:
+    # Goes through the real WikipediaRetriever so the request exercises its event loop handling.
+    def __init__(self):
+        self.wikipedia_retriever = WikipediaRetriever(cache_dir=None)
+
+        async def fake_query(session, **params):
+            if params.get("list") == "search":
+                return {"query": {"search": [{"title": "Paris"}]}}
+            return {"query": {"pages": [{"title": "Paris", "extract": EVIDENCE}]}}
+
+        self.wikipedia_retriever._query = fake_query
+
+    def retrieve_evidence(self, question):
+        return self.wikipedia_retriever.retrieve_evidence_documents(question)
+
+
+@pytest.fixture
+def api(monkeypatch):
+    monkeypatch.setattr(detection_main, "HallucinationAnalysisPipeline", FakePipeline)
+    monkeypatch.setattr(retrieval_module, "_retriever_instance", StubEvidenceRetriever())
+    monkeypatch.syspath_prepend(FRONTEND_DIR)
+    sys.modules.pop("api", None)
+    yield importlib.import_module("api")
+    sys.modules.pop("api", None)
+
+
+def test_detect_hallucination_passes_evidence_to_detector(api):
+    response = api.app.test_client().post("/detect_hallucination", json={"question": "What is the capital of France?"})
+
+    assert response.status_code == 200
+    assert api.pipeline.detected_evidence == [[EVIDENCE]]
+    assert response.get_json()["is_hallucination"] is False
+
+
+def test_detect_hallucination_requires_question(api):
+    response = api.app.test_client().post("/detect_hallucination", json={})
+
+    assert response.status_code == 400
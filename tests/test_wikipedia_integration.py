@@ -0,0 +1,79 @@
+import asyncio
+
+import pytest
+
+from src.retrieval.wikipedia_integration import WikipediaRetriever
+
+PAGES = {
+    "Paris": "Paris is the capital and largest city of France.",
+    "France": "France is a country in Western Europe.",
+}
+
+
+@pytest.fixture
+def retriever(monkeypatch):
+    retriever = WikipediaRetriever(cache_dir=None)
+
+    async def fake_query(session, **params):
+        if params.get("list") == "search":
+            return {"query": {"search": [{"title": title} for title in PAGES]}}
+        title = params["titles"]
+        return {"query": {"pages": [{"title": title, "extract": PAGES[title]}]}}
+
+    monkeypatch.setattr(retriever, "_query", fake_query)
+    return retriever
+
+
+def test_retrieve_evidence_documents(retriever):
+    assert retriever.retrieve_evidence_documents("What is the capital of France?") == list(PAGES.values())
+
+
+def test_retrieve_evidence_documents_inside_running_loop(retriever):
+    async def caller():
+        return retriever.retrieve_evidence_documents("What is the capital of France?")
+
+    assert asyncio.run(caller()) == list(PAGES.values())
+
+
+def test_get_page_summary_inside_running_loop(retriever):
+    async def caller():
+        return retriever.get_page_summary("Paris")
+
+    assert asyncio.run(caller()) == PAGES["Paris"]
+
+
+def test_pending_fetches_cancelled_after_max_results(monkeypatch):
+    retriever = WikipediaRetriever(max_results=1, cache_dir=None)
+    cancelled = []
+
+    async def fake_query(session, **params):
+        if params.get("list") == "search":
+            return {"query": {"search": [{"title": "Paris"}, {"title": "Slow"}]}}
+        title = params["titles"]
+        if title == "Slow":
+            try:
+                await asyncio.sleep(30)
+            except asyncio.CancelledError:
+                cancelled.append(title)
+                raise
+        return {"query": {"pages": [{"title": title, "extract": PAGES.get(title, "")}]}}
+
+    monkeypatch.setattr(retriever, "_query", fake_query)
+    assert retriever.retrieve_evidence_documents("Paris") == [PAGES["Paris"]]
+    assert cancelled == ["Slow"]
+
+
+def test_http_session_reused_across_calls(monkeypatch):
+    retriever = WikipediaRetriever(cache_dir=None)
+    sessions = set()
+
+    async def fake_query(session, **params):
+        sessions.add(id(session))
+        if params.get("list") == "search":
+            return {"query": {"search": [{"title": "Paris"}]}}
+        return {"query": {"pages": [{"title": "Paris", "extract": PAGES["Paris"]}]}}
+
+    monkeypatch.setattr(retriever, "_query", fake_query)
+    retriever.retrieve_evidence_documents("Paris")
+    retriever.get_page_summary("Paris")
+    assert len(sessions) == 1